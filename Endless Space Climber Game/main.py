@@ -1,6 +1,15 @@
 import pygame
 import random
 import os
+import sys
+import math
+import time
+import atexit
+import tracemalloc
+import linecache
+import threading
+import struct
+from collections import namedtuple, deque
 
 # Constants - colours
 PURPLE = (228, 0, 224)
@@ -30,6 +39,32 @@ ASTEROID_OFFSET = 150
 STAR_WIDTH, STAR_HEIGHT = 30, 30
 STAR_CHANCE = 0.25
 
+# Constants - instrumentation
+MEASURE_LATENCY = "--measure-latency" in sys.argv
+LATENCY_BUDGET_MS = 50
+INPUT_EVENT_TYPES = (pygame.KEYDOWN, pygame.KEYUP, pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP)
+PROFILE_ALLOCATIONS = "--profile-allocations" in sys.argv
+PROFILER_TOGGLE_KEY = pygame.K_F9
+PROFILER_TOP_SITES = 10
+PROFILER_CALIBRATION_LINES = 1000  # lines that allocate nothing, traced to measure what tracing costs per line
+THREADED_SIMULATION = "--threaded" in sys.argv
+
+# Constants - saving and restoring
+SAVE_KEY = pygame.K_F5
+RESTORE_KEY = pygame.K_F8
+SAVE_FILE = "world.sav"
+SAVE_MAGIC = b"ESCW"
+SAVE_VERSION = 1
+USERNAME_BYTES = 32
+STATUS_MESSAGE_FRAMES = 2 * FPS  # how long "Game saved" etc. stays on screen
+
+# Fixed binary layouts (little-endian) of a saved world: a header, then the players, asteroids and stars, then the
+# state of the random number generator
+SAVE_HEADER = struct.Struct("<4sHB?dHHH")  # magic, version, asteroids per wave, two player, time elapsed, counts
+SAVE_PLAYER = struct.Struct("<ddddi??B?{}s".format(USERNAME_BYTES))  # position, velocity, score, flags, username
+SAVE_SOLID = struct.Struct("<dddd")  # position and velocity of an asteroid or star
+SAVE_RANDOM = struct.Struct("<625I?d")  # Mersenne Twister state and index, whether gauss_next is set, gauss_next
+
 # initialising pygame and creating the game window
 pygame.init()
 WINDOW = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
@@ -323,6 +358,624 @@ class Star(SolidObject):
             SolidObject.stars.remove(self)
 
 
+class GameWorld(object):
+    """ A class that holds the state of a game (other than the SolidObject lists) and moves it forward frame by frame"""
+
+    def __init__(self, usernames):
+        """
+       Creates the players, asteroids and stars for a new game.
+       :param usernames: A list of usernames. The length of this list is used to distinguish between single and two
+       player.
+       """
+
+        # Initial difficulty variables
+        self.time_elapsed = 0
+        self.asteroids_per_wave = 3
+        self.requested_keys = deque()  # SAVE_KEY or RESTORE_KEY for each save or restore waiting for the next step
+        self.status_message = None  # shown at the bottom of the screen for STATUS_MESSAGE_FRAMES after a save/restore
+        self.status_frames = 0
+
+        # Creating player instances
+        SolidObject.players = []
+        self.two_player = len(usernames) == 2
+        if self.two_player:
+            self.player_one = Player(600, PLAYER_Y_SPAWN, usernames[0], 1)
+            self.player_two = Player(600, PLAYER_Y_SPAWN, usernames[1], 2)
+        else:
+            self.player_one = Player(600, PLAYER_Y_SPAWN, usernames[0], 1)
+            self.player_two = Player(0, 0, "", 2)
+
+        # Creating asteroids and stars
+        SolidObject.asteroids = []
+        SolidObject.stars = []
+        wave_y_pos = PLAYER_Y_SPAWN + PLAYER_HEIGHT
+        while wave_y_pos > - ASTEROID_HEIGHT - (SCREEN_HEIGHT - PLAYER_Y_SPAWN):
+            generate_asteroid_wave(wave_y_pos, self.asteroids_per_wave, False)
+            wave_y_pos -= 150
+
+        # Creating row of asteroids at the bottom so that players don't die at the start
+        asteroid_x = 0
+        for i in range(SCREEN_WIDTH // ASTEROID_SPRITE_WIDTH):
+            Asteroid(asteroid_x, PLAYER_Y_SPAWN + PLAYER_HEIGHT)
+            asteroid_x += ASTEROID_SPRITE_WIDTH
+
+    def step(self, keys_pressed):
+        """
+       Moves everything in the world forward by one frame.
+       :param keys_pressed: The state of the keyboard, as returned by pygame.key.get_pressed()
+       :return: A message describing the result if the win/lose conditions have been met, otherwise None
+       """
+
+        # Saving or restoring between steps so that it happens on whichever thread owns the world. The main thread
+        # appends the keys and this takes them with popleft, which are each atomic, so a key pressed while a step is
+        # running is handled in the next step rather than lost
+        while self.requested_keys:
+            key = self.requested_keys.popleft()
+            if key == SAVE_KEY:
+                try:
+                    save_to_file(self.save())
+                    self.show_status("Game saved")
+                except OSError as error:
+                    self.show_status("Couldn't save the game ({})".format(error.strerror))
+            elif key == RESTORE_KEY:
+                try:
+                    self.restore(load_from_file())
+                    self.show_status("Game restored")
+                except OSError as error:
+                    self.show_status("Couldn't restore the game ({})".format(error.strerror))
+                except (ValueError, struct.error):
+                    self.show_status("Couldn't restore the game (the save is damaged or from another version)")
+        if self.status_frames > 0:
+            self.status_frames -= 1
+
+        # Player movement
+        self.player_one.handle_movement(keys_pressed)
+        self.player_two.handle_movement(keys_pressed)
+        allocation_profiler.end_phase("players")
+
+        # Win/Lose conditions
+        if self.two_player:
+            if not self.player_one.alive:
+                return "The winner was {}".format(self.player_two.username)
+            elif not self.player_two.alive:
+                return "The winner was {}".format(self.player_one.username)
+        else:
+            if not self.player_one.alive:
+                return "Your score was {}".format(self.player_one.score)
+
+        # Handling asteroids
+        for asteroid in SolidObject.asteroids:
+            asteroid.handle_movement()
+        if len(SolidObject.asteroids) < 4 * self.asteroids_per_wave:
+            generate_asteroid_wave(-ASTEROID_HEIGHT, self.asteroids_per_wave, not self.two_player)
+        allocation_profiler.end_phase("asteroids")
+
+        # Handling stars
+        for star in SolidObject.stars:
+            star.handle_movement()
+        allocation_profiler.end_phase("stars")
+
+        # Increasing difficulty over time
+        self.time_elapsed += 1 / 60
+        if self.time_elapsed > 120:
+            self.asteroids_per_wave = 5
+        elif self.time_elapsed > 45:
+            self.asteroids_per_wave = 4
+
+    def show_status(self, message):
+        """
+       Shows a message at the bottom of the screen for a couple of seconds.
+       :param message: The message to show e.g. "Game saved"
+       """
+        self.status_message = message
+        self.status_frames = STATUS_MESSAGE_FRAMES
+
+    def current_status(self):
+        """
+       :return: The status message that is on screen, or None
+       """
+        return self.status_message if self.status_frames > 0 else None
+
+    def draw(self):
+        """ Draws the current state of the world onto the pygame window"""
+        WINDOW.blit(BACKGROUND_IMAGE, (0, 0))
+        for asteroid in SolidObject.asteroids:
+            asteroid.draw_sprite()
+        for star in SolidObject.stars:
+            star.draw_sprite()
+        self.player_one.draw()
+        if self.two_player:
+            self.player_two.draw()
+        else:
+            draw_text("Score: {}".format(self.player_one.score), (0, 0), SCORE_FONT, WHITE)
+        draw_status(self.current_status())
+
+    def save(self):
+        """
+       Packs the whole world (including the random number generator) into a compact, fixed-layout binary blob.
+       :return: The blob as bytes
+       """
+        players, asteroids, stars = SolidObject.players, SolidObject.asteroids, SolidObject.stars
+        random_version, random_state, gauss_next = random.getstate()
+        blob = bytearray(SAVE_HEADER.size + SAVE_PLAYER.size * len(players) +
+                         SAVE_SOLID.size * (len(asteroids) + len(stars)) + SAVE_RANDOM.size)
+
+        SAVE_HEADER.pack_into(blob, 0, SAVE_MAGIC, SAVE_VERSION, self.asteroids_per_wave, self.two_player,
+                              self.time_elapsed, len(players), len(asteroids), len(stars))
+        offset = SAVE_HEADER.size
+        for player in players:
+            SAVE_PLAYER.pack_into(blob, offset, player.x, player.y, player.x_vel, player.y_vel, player.score,
+                                  player.alive, player.standing_on_asteroid, player.player_num,
+                                  player.sprite is ASTRONAUT_LEFT_SPRITE, player.username.encode()[:USERNAME_BYTES])
+            offset += SAVE_PLAYER.size
+        for solid_object in asteroids + stars:
+            SAVE_SOLID.pack_into(blob, offset, solid_object.x, solid_object.y, solid_object.x_vel, solid_object.y_vel)
+            offset += SAVE_SOLID.size
+        SAVE_RANDOM.pack_into(blob, offset, *random_state, gauss_next is not None, gauss_next or 0.0)
+        return bytes(blob)
+
+    def restore(self, blob):
+        """
+       Replaces the whole world (including the random number generator) with one that was packed by save(). The blob
+       is checked before anything is replaced, so the world is left as it was if it can't be restored.
+       :param blob: The bytes returned by save()
+       :raises ValueError: If the blob isn't a complete save of this version
+       :raises struct.error: If the blob is too short to have a header
+       """
+        magic, version, asteroids_per_wave, two_player, time_elapsed, player_count, asteroid_count, star_count = \
+            SAVE_HEADER.unpack_from(blob, 0)
+        if magic != SAVE_MAGIC or version != SAVE_VERSION:
+            raise ValueError("Not a version {} world save".format(SAVE_VERSION))
+        expected_size = (SAVE_HEADER.size + SAVE_PLAYER.size * player_count +
+                         SAVE_SOLID.size * (asteroid_count + star_count) + SAVE_RANDOM.size)
+        if player_count != 2 or len(blob) != expected_size:
+            raise ValueError("World save is damaged")
+        self.asteroids_per_wave = asteroids_per_wave
+        self.two_player = two_player
+        self.time_elapsed = time_elapsed
+
+        view = memoryview(blob)
+        offset = SAVE_HEADER.size
+        SolidObject.players = []
+        players_end = offset + SAVE_PLAYER.size * player_count
+        for x, y, x_vel, y_vel, score, alive, standing, player_num, facing_left, username in \
+                SAVE_PLAYER.iter_unpack(view[offset:players_end]):
+            player = Player(x, y, username.rstrip(b"\0").decode(), player_num)
+            player.x_vel, player.y_vel = x_vel, y_vel
+            player.score, player.alive, player.standing_on_asteroid = score, alive, standing
+            if facing_left:
+                player.sprite = ASTRONAUT_LEFT_SPRITE
+        self.player_one, self.player_two = sorted(SolidObject.players, key=lambda p: p.player_num)
+
+        SolidObject.asteroids = []
+        asteroids_end = players_end + SAVE_SOLID.size * asteroid_count
+        for x, y, x_vel, y_vel in SAVE_SOLID.iter_unpack(view[players_end:asteroids_end]):
+            asteroid = Asteroid(x, y)
+            asteroid.x_vel, asteroid.y_vel = x_vel, y_vel
+
+        SolidObject.stars = []
+        stars_end = asteroids_end + SAVE_SOLID.size * star_count
+        for x, y, x_vel, y_vel in SAVE_SOLID.iter_unpack(view[asteroids_end:stars_end]):
+            star = Star(x, y)
+            star.x_vel, star.y_vel = x_vel, y_vel
+
+        random_state = SAVE_RANDOM.unpack_from(blob, stars_end)
+        gauss_next = random_state[-1] if random_state[-2] else None
+        random.setstate((3, random_state[:-2], gauss_next))
+
+    def take_snapshot(self, last_input, end_message):
+        """
+       Copies everything that is needed to draw the world into an immutable snapshot.
+       :param last_input: The number of the newest input that the world has been stepped with (see LatencyMonitor)
+       :param end_message: The message returned by step(), or None if the game is still going
+       :return: A WorldSnapshot of the world as it is now
+       """
+        if self.two_player:
+            players = (self.player_one, self.player_two)
+        else:
+            players = (self.player_one,)
+        return WorldSnapshot(tuple(PlayerSnapshot(player.x, player.y, player.sprite, player.username)
+                                   for player in players),
+                             tuple((asteroid.x, asteroid.y) for asteroid in SolidObject.asteroids),
+                             tuple((star.x, star.y) for star in SolidObject.stars),
+                             self.player_one.score, self.two_player, self.current_status(), last_input,
+                             end_message)
+
+
+# Immutable copies of the world that the simulation thread hands over to the render thread
+PlayerSnapshot = namedtuple("PlayerSnapshot", ["x", "y", "sprite", "username"])
+WorldSnapshot = namedtuple("WorldSnapshot", ["players", "asteroids", "stars", "score", "two_player",
+                                             "status_message", "last_input", "end_message"])
+
+
+class SnapshotBuffer(object):
+    """ A double buffer of world snapshots. The simulation fills the back slot and then swaps it to the front."""
+
+    def __init__(self):
+        """ Constructs an empty buffer"""
+        self.slots = [None, None]
+        self.front = 0
+        self.lock = threading.Lock()
+
+    def publish(self, snapshot):
+        """
+       Writes a snapshot into the back slot and makes it the front slot.
+       :param snapshot: The WorldSnapshot that has just been taken
+       """
+        back = 1 - self.front
+        self.slots[back] = snapshot
+        with self.lock:
+            self.front = back
+
+    def latest(self):
+        """
+       :return: The most recently published WorldSnapshot
+       """
+        with self.lock:
+            return self.slots[self.front]
+
+
+class SimulationThread(threading.Thread):
+    """ A thread that steps a GameWorld at a fixed rate and publishes a snapshot after every step"""
+
+    def __init__(self, world, snapshots):
+        """
+       Constructs the necessary attributes of the simulation thread
+       :param world: The GameWorld to step. Only this thread may touch it (and the SolidObject lists) once started.
+       :param snapshots: The SnapshotBuffer that snapshots are published to
+       """
+        super().__init__(daemon=True)
+        self.world = world
+        self.snapshots = snapshots
+        self.input = (pygame.key.get_pressed(), latency_monitor.input_count)
+        self.running = True
+
+    def set_input(self, keys_pressed, last_input):
+        """
+       Hands the latest keyboard state over from the main thread (only the main thread may pump pygame events).
+       :param keys_pressed: The state of the keyboard, as returned by pygame.key.get_pressed()
+       :param last_input: The number of the newest input that has been read (see LatencyMonitor)
+       """
+        self.input = (keys_pressed, last_input)
+
+    def run(self):
+        """ Steps the world until the win/lose conditions are met or the thread is stopped"""
+        simulation_clock = pygame.time.Clock()
+        while self.running:
+            allocation_profiler.begin_frame()
+            try:
+                keys_pressed, last_input = self.input
+                end_message = self.world.step(keys_pressed)
+                self.snapshots.publish(self.world.take_snapshot(last_input, end_message))
+                allocation_profiler.end_phase("snapshot")
+            finally:
+                allocation_profiler.end_frame()
+            if end_message is not None:
+                return
+            simulation_clock.tick(FPS)
+
+    def stop(self):
+        """ Stops the simulation and waits for the thread to finish"""
+        self.running = False
+        self.join()
+
+
+class LatencyMonitor(object):
+    """ A class that measures the delay between an input event and the first frame that is displayed after it"""
+
+    def __init__(self, enabled, budget_ms):
+        """
+       Constructs the necessary attributes of the latency monitor
+       :param enabled: A bool value. If false, events and frames are passed through without being timed.
+       :param budget_ms: The latency (in milliseconds) that the kiosks are expected to stay under
+       """
+        self.enabled = enabled
+        self.budget_ms = budget_ms
+        self.input_count = 0
+        # (input number, time the event was read, earliest time it could have happened) for inputs that haven't been
+        # displayed yet. pygame doesn't say when an event happened, only that it happened after the queue was last read
+        self.pending_inputs = []
+        self.last_read_time = None
+        self.latencies = {}  # screen name -> list of latencies in milliseconds, measured from when the event was read
+        self.latency_bounds = {}  # screen name -> list of worst-case latencies, including the time spent in the queue
+        self.frame_counts = {}  # screen name -> number of frames displayed
+
+    def get_events(self):
+        """
+       Gets the events from the pygame event queue and timestamps the input events among them.
+       :return: The list of events, as returned by pygame.event.get()
+       """
+        events = pygame.event.get()
+        if self.enabled:
+            read_time = time.perf_counter()
+            earliest_time = self.last_read_time if self.last_read_time is not None else read_time
+            for event in events:
+                if event.type in INPUT_EVENT_TYPES:
+                    self.input_count += 1
+                    self.pending_inputs.append((self.input_count, read_time, earliest_time))
+            self.last_read_time = read_time
+        return events
+
+    def update_display(self, screen, last_input=None):
+        """
+       Updates the pygame display and records the latency of every input that this frame is the first to reflect.
+       :param screen: The name of the screen that is displaying the frame e.g. "play_game"
+       :param last_input: The number of the newest input that the frame was built from. If None, the frame reflects
+       every input that has been read so far.
+       """
+        pygame.display.update()
+        if not self.enabled:
+            return
+
+        display_time = time.perf_counter()
+        self.frame_counts[screen] = self.frame_counts.get(screen, 0) + 1
+        if last_input is None:
+            last_input = self.input_count
+
+        # Inputs are read in order, so the ones reflected by this frame are at the front of the pending list
+        screen_latencies = self.latencies.setdefault(screen, [])
+        screen_bounds = self.latency_bounds.setdefault(screen, [])
+        reflected = 0
+        for input_number, read_time, earliest_time in self.pending_inputs:
+            if input_number > last_input:
+                break
+            screen_latencies.append((display_time - read_time) * 1000)
+            screen_bounds.append((display_time - earliest_time) * 1000)
+            reflected += 1
+        del self.pending_inputs[:reflected]
+
+    def report(self):
+        """
+       Prints the latency distribution of each screen and whether or not it stays under the latency budget. The
+       measured latencies start when an event was read, so they leave out the time it waited in the queue (up to a
+       whole frame). The worst-case latencies start when the queue was read before that, so the true latency of every
+       input is somewhere between the two.
+       """
+
+        if not self.enabled:
+            return
+
+        print("Input-to-display latency (budget {} ms)".format(self.budget_ms))
+        for screen, screen_latencies in sorted(self.latencies.items()):
+            if len(screen_latencies) == 0:
+                continue
+            print("  {}: {} inputs over {} frames".format(screen, len(screen_latencies), self.frame_counts[screen]))
+            for name, latencies in (("measured", screen_latencies), ("worst case", self.latency_bounds[screen])):
+                latencies = sorted(latencies)
+                over_budget = len([latency for latency in latencies if latency > self.budget_ms])
+                print("    {}: min {:.1f} / p50 {:.1f} / p95 {:.1f} / p99 {:.1f} / max {:.1f} ms, "
+                      "{} over budget".format(name, latencies[0], percentile(latencies, 0.50),
+                                              percentile(latencies, 0.95), percentile(latencies, 0.99), latencies[-1],
+                                              over_budget))
+
+
+latency_monitor = LatencyMonitor(MEASURE_LATENCY, LATENCY_BUDGET_MS)
+atexit.register(latency_monitor.report)
+
+
+def profiler_calibration_loop(count):
+    """
+   Runs lines that allocate nothing, for the allocation profiler to measure its own overhead on.
+   :param count: How many times to run the loop
+   """
+    value = 0
+    for _ in range(count):
+        value = value
+    return value
+
+
+class AllocationProfiler(object):
+    """
+    A class that attributes memory allocations to phases of the frame and to source lines as they happen. While a frame
+    is being profiled, a trace function runs before every line and reads tracemalloc's peak since the line before, so
+    objects that are allocated and freed within the frame (Rects, text surfaces, tuples) are counted where they were
+    made instead of only the ones that are still alive at the end of a phase. Tracing itself holds on to the locals of
+    the traced function between lines, so a line that rebinds a local can be charged for an object that would otherwise
+    have been freed a line earlier. Reading the traced memory allocates too, so every line seems to allocate a little;
+    start measures how much on lines that allocate nothing, and that is taken off every line.
+
+    tracemalloc's counters are shared by every thread, so a thread holds the profiler's lock from begin_frame to
+    end_frame while profiling is on. With the threaded simulation, the simulation and drawing threads then take turns
+    instead of overlapping. Switching profiling on or off and reporting also take the lock, so they never happen in
+    the middle of a frame on another thread.
+    """
+
+    def __init__(self, enabled):
+        """
+       Constructs the necessary attributes of the allocation profiler
+       :param enabled: A bool value for whether or not profiling starts straight away
+       """
+        self.enabled = False
+        self.toggle_requested = False
+        self.lock = threading.RLock()
+        self.frames = {}  # thread name -> frames profiled on that thread
+        self.phase_totals = {}  # phase -> [bytes allocated, allocating lines run, bytes retained, times it ran]
+        self.site_totals = {}  # (filename, line number) -> [bytes allocated, times it allocated]
+        self.line_overhead = 0  # bytes that every traced line seems to allocate because of the tracing itself
+        # The state of the frame that is being profiled on each thread: whether it is being traced, the line that is
+        # running, the traced memory when that line started and what the current phase has allocated so far
+        self.local = threading.local()
+        if enabled:
+            self.start()
+
+    def start(self):
+        """
+       Starts tracing allocations, measures the overhead of tracing a line and clears the results of any previous
+       profiling run
+       """
+        tracemalloc.start()
+        self.enabled = True
+        self.frames = {}
+        self.phase_totals = {}
+
+        # The overhead is the least that a line that allocates nothing is charged on average. With it taken off, the
+        # same lines should come to (about) nothing
+        self.line_overhead = 0
+        self.line_overhead = int(min((size / count for size, count in self.trace_calibration_loop().values()),
+                                     default=0))
+        leftover = sum(size for size, count in self.trace_calibration_loop().values())
+        if leftover > PROFILER_CALIBRATION_LINES:
+            print("Allocation profiler: tracing overhead isn't steady, {} B was left over on {} lines that allocate "
+                  "nothing".format(leftover, PROFILER_CALIBRATION_LINES))
+        self.site_totals = {}
+
+    def trace_calibration_loop(self):
+        """
+       Traces profiler_calibration_loop, taking off the current line overhead.
+       :return: The site totals (see site_totals) it was charged
+       """
+        self.site_totals = {}
+        self.local.site = None
+        self.local.phase_allocated = 0
+        self.local.phase_allocations = 0
+        self.reset_mark()
+        sys.settrace(self.trace)
+        profiler_calibration_loop(PROFILER_CALIBRATION_LINES)
+        sys.settrace(None)
+        return self.site_totals
+
+    def stop(self):
+        """ Reports the results and stops tracing allocations"""
+        self.report()
+        self.enabled = False
+        tracemalloc.stop()
+
+    def toggle(self):
+        """ Switches profiling on or off at the start of the next frame, on whichever thread begins one first"""
+        self.toggle_requested = True
+
+    def begin_frame(self):
+        """
+       Counts a new frame and starts tracing the lines run by it, including the rest of the calling function. Every
+       thread that calls this must call end_frame when its frame is over.
+       """
+        if not self.enabled and not self.toggle_requested:
+            return
+        self.lock.acquire()
+        if self.toggle_requested:
+            self.toggle_requested = False
+            if self.enabled:
+                self.stop()
+            else:
+                self.start()
+        if not self.enabled:
+            self.lock.release()
+            return
+
+        thread_name = threading.current_thread().name
+        self.frames[thread_name] = self.frames.get(thread_name, 0) + 1
+        self.local.tracing = True
+        caller = sys._getframe(1)
+        caller.f_trace = self.trace
+        self.local.site = (caller.f_code.co_filename, caller.f_lineno)
+        self.local.phase_allocated = 0
+        self.local.phase_allocations = 0
+        tracemalloc.reset_peak()
+        self.local.mark = self.local.phase_start_size = tracemalloc.get_traced_memory()[0]
+        sys.settrace(self.trace)
+
+    def end_frame(self):
+        """ Stops tracing lines until the next frame begins and lets other threads profile their frames"""
+        if not getattr(self.local, "tracing", False):
+            return
+        self.count_allocations()
+        sys.settrace(None)
+        sys._getframe(1).f_trace = None
+        self.local.tracing = False
+        self.lock.release()
+
+    def trace(self, frame, event, arg):
+        """ The trace function (see sys.settrace). Counts what the previous line allocated and moves on to the next."""
+        self.count_allocations()
+        if event == "call" and frame.f_code in AllocationProfiler.own_code:
+            return None  # the profiler's own methods aren't traced
+        if event == "return":
+            caller = frame.f_back
+            self.local.site = (caller.f_code.co_filename, caller.f_lineno) if caller is not None else None
+        else:
+            self.local.site = (frame.f_code.co_filename, frame.f_lineno)
+        self.reset_mark()
+        return self.trace
+
+    def count_allocations(self):
+        """
+       Attributes the memory allocated since the last mark to the line that is running. This is the highest traced
+       memory reached above the mark, less the line overhead, so it is a lower bound if a line frees memory before
+       allocating more.
+       """
+        allocated = tracemalloc.get_traced_memory()[1] - self.local.mark - self.line_overhead
+        if allocated > 0 and self.local.site is not None:
+            site_total = self.site_totals.setdefault(self.local.site, [0, 0])
+            site_total[0] += allocated
+            site_total[1] += 1
+            self.local.phase_allocated += allocated
+            self.local.phase_allocations += 1
+        self.reset_mark()
+
+    def reset_mark(self):
+        """ Marks the traced memory now. This is done after recording, so the profiler's own allocations don't count."""
+        tracemalloc.reset_peak()
+        self.local.mark = tracemalloc.get_traced_memory()[0]
+
+    def end_phase(self, phase):
+        """
+       Attributes the allocations made since the end of the previous phase to this phase.
+       :param phase: The name of the phase of the frame that has just finished e.g. "drawing"
+       """
+        if not getattr(self.local, "tracing", False):
+            return
+
+        self.count_allocations()
+        phase_total = self.phase_totals.setdefault(phase, [0, 0, 0, 0])
+        phase_total[0] += self.local.phase_allocated
+        phase_total[1] += self.local.phase_allocations
+        phase_total[2] += self.local.mark - self.local.phase_start_size
+        phase_total[3] += 1
+        self.local.phase_allocated = 0
+        self.local.phase_allocations = 0
+        self.local.phase_start_size = self.local.mark
+
+    def report(self):
+        """ Prints the allocations per frame for each phase and the source lines that allocate the most"""
+
+        with self.lock:
+            if not self.enabled or not self.frames:
+                return
+            phase_totals = dict(self.phase_totals)
+            site_totals = dict(self.site_totals)
+            frames = max(self.frames.values())  # the simulation and drawing threads each count the frames they run
+
+        print("Allocations per frame over {} frames".format(frames))
+        for phase, (size, count, retained, runs) in phase_totals.items():
+            print("  {}: {:.0f} B allocated by {:.1f} lines, {:.0f} B retained".format(phase, size / runs, count / runs,
+                                                                                    retained / runs))
+
+        print("Top allocation sites")
+        top_sites = sorted(site_totals.items(), key=lambda site: site[1][1], reverse=True)
+        for (filename, lineno), (size, count) in top_sites[:PROFILER_TOP_SITES]:
+            print("  {}:{}: {:.0f} B in {:.1f} allocations per frame".format(os.path.basename(filename), lineno,
+                                                                            size / frames, count / frames))
+            print("      {}".format(linecache.getline(filename, lineno).strip()))
+
+
+# Code of the profiler itself, which allocates while the results are being recorded
+AllocationProfiler.own_code = set(method.__code__ for method in vars(AllocationProfiler).values()
+                                  if hasattr(method, "__code__"))
+allocation_profiler = AllocationProfiler(PROFILE_ALLOCATIONS)
+atexit.register(allocation_profiler.report)
+
+
+def percentile(sorted_values, fraction):
+    """
+   Finds a percentile of a list of values using the nearest-rank method.
+   :param sorted_values: A non-empty list of values, sorted from smallest to largest
+   :param fraction: The percentile as a fraction e.g. 0.95 for the 95th percentile
+   :return: The value at that percentile
+   """
+    rank = max(math.ceil(fraction * len(sorted_values)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
 def draw_text(string, position, font, colour):
     """ Creates a surface with text and draws it onto the pygame window"""
 
@@ -374,7 +1027,7 @@ def get_username(prompt):
     username = ""
     getting_input = True
     while getting_input:
-        for event in pygame.event.get():
+        for event in latency_monitor.get_events():
             if event.type == pygame.QUIT:
                 quit()
             if event.type == pygame.KEYUP:
@@ -408,7 +1061,7 @@ def get_username(prompt):
         if display_cursor:
             pygame.draw.rect(WINDOW, WHITE, cursor)
         draw_text(text_string, (text_box.x, text_box.y), TEXT_BOX_FONT, text_colour)
-        pygame.display.update()
+        latency_monitor.update_display("get_username")
 
     return username
 
@@ -441,7 +1094,7 @@ def start_menu():
     looping = True
     while looping:
         mouse_pressed = False
-        for event in pygame.event.get():
+        for event in latency_monitor.get_events():
             if event.type == pygame.QUIT:
                 looping = False
             if event.type == pygame.MOUSEBUTTONUP:
@@ -464,7 +1117,27 @@ def start_menu():
         for button in Button.buttons:
             button.draw()
         WINDOW.blit(MOUSE_SPRITE, mouse_pos)
-        pygame.display.update()
+        latency_monitor.update_display("start_menu")
+
+
+def save_to_file(blob):
+    """
+   Writes a saved world to SAVE_FILE. The file is replaced in one go so a crash can't leave half a save behind.
+   :param blob: The bytes returned by GameWorld.save()
+   """
+    temporary_file = SAVE_FILE + ".tmp"
+    with open(temporary_file, "wb") as file:
+        file.write(blob)
+    os.replace(temporary_file, SAVE_FILE)
+
+
+def load_from_file():
+    """
+   Reads the saved world from SAVE_FILE
+   :return: The bytes that were written by save_to_file()
+   """
+    with open(SAVE_FILE, "rb") as file:
+        return file.read()
 
 
 def play_game(usernames):
@@ -473,91 +1146,118 @@ def play_game(usernames):
    :param usernames: A list of usernames. The length of this list is used to distinguish between single and two player.
    :return: A bool value for whether or not the player has chosen to play again.
    """
-
-    # Initial difficulty variables
-    time_elapsed = 0
-    asteroids_per_wave = 3
-
-    # Creating player instances
-    SolidObject.players = []
-    two_player = len(usernames) == 2
-    if two_player:
-        player_one = Player(600, PLAYER_Y_SPAWN, usernames[0], 1)
-        player_two = Player(600, PLAYER_Y_SPAWN, usernames[1], 2)
-    else:
-        player_one = Player(600, PLAYER_Y_SPAWN, usernames[0], 1)
-        player_two = Player(0, 0, "", 2)
-
-    # Creating asteroids and stars
-    SolidObject.asteroids = []
-    SolidObject.stars = []
-    wave_y_pos = PLAYER_Y_SPAWN + PLAYER_HEIGHT
-    while wave_y_pos > - ASTEROID_HEIGHT - (SCREEN_HEIGHT - PLAYER_Y_SPAWN):
-        generate_asteroid_wave(wave_y_pos, asteroids_per_wave, False)
-        wave_y_pos -= 150
-
-    # Creating row of asteroids at the bottom so that players don't die at the start
-    asteroid_x = 0
-    for i in range(SCREEN_WIDTH // ASTEROID_SPRITE_WIDTH):
-        Asteroid(asteroid_x, PLAYER_Y_SPAWN + PLAYER_HEIGHT)
-        asteroid_x += ASTEROID_SPRITE_WIDTH
+    world = GameWorld(usernames)
+    if THREADED_SIMULATION:
+        return play_game_threaded(world)
 
     # Keep playing until the win/lose conditions are met
     playing_game = True
     while playing_game:
-        for event in pygame.event.get():
+        allocation_profiler.begin_frame()
+        for event in latency_monitor.get_events():
             if event.type == pygame.QUIT:
                 quit()
+            if event.type == pygame.KEYUP and event.key == PROFILER_TOGGLE_KEY:
+                allocation_profiler.toggle()
+            if event.type == pygame.KEYUP and event.key in (SAVE_KEY, RESTORE_KEY):
+                world.requested_keys.append(event.key)
+        allocation_profiler.end_phase("input")
+
+        # Moving everything in the world and checking the win/lose conditions
+        end_message = world.step(pygame.key.get_pressed())
+        if end_message is not None:
+            allocation_profiler.end_frame()
+            return end_game_screen(end_message)
 
-        # Player movement
-        keys_pressed = pygame.key.get_pressed()
-        player_one.handle_movement(keys_pressed)
-        player_two.handle_movement(keys_pressed)
-
-        # Win/Lose conditions
-        if two_player:
-            if not player_one.alive:
-                return end_game_screen("The winner was {}".format(player_two.username))
-            elif not player_two.alive:
-                return end_game_screen("The winner was {}".format(player_one.username))
-        else:
-            if not player_one.alive:
-                return end_game_screen("Your score was {}".format(player_one.score))
+        # Drawing frame onto the screen
+        world.draw()
+        allocation_profiler.end_phase("drawing")
+        latency_monitor.update_display("play_game")
 
-        # Handling asteroids
-        for asteroid in SolidObject.asteroids:
-            asteroid.handle_movement()
-        if len(SolidObject.asteroids) < 4 * asteroids_per_wave:
-            generate_asteroid_wave(-ASTEROID_HEIGHT, asteroids_per_wave, not two_player)
+        # set the max frames per seconds
+        clock.tick(FPS)
+        allocation_profiler.end_phase("display")
+        allocation_profiler.end_frame()
 
-        # Handling stars
-        for star in SolidObject.stars:
-            star.handle_movement()
 
-        # Increasing difficulty over time
-        time_elapsed += 1 / 60
-        if time_elapsed > 120:
-            asteroids_per_wave = 5
-        elif time_elapsed > 45:
-            asteroids_per_wave = 4
+def play_game_threaded(world):
+    """
+   Plays the game with the simulation running on its own thread. This (main) thread handles input and draws the most
+   recent snapshot of the world, so a slow display update doesn't hold up the physics and vice versa.
+   :param world: The GameWorld that the simulation thread will step
+   :return: A bool value for whether or not the player has chosen to play again.
+   """
+    snapshots = SnapshotBuffer()
+    snapshots.publish(world.take_snapshot(latency_monitor.input_count, None))
+    simulation = SimulationThread(world, snapshots)
+    simulation.start()
+
+    # The profiled frame of this thread ends before anything waits for the simulation thread (which may be waiting
+    # to profile its own frame) and before sleeping until the next frame
+    while True:
+        allocation_profiler.begin_frame()
+        for event in latency_monitor.get_events():
+            if event.type == pygame.QUIT:
+                allocation_profiler.end_frame()
+                simulation.stop()
+                quit()
+            if event.type == pygame.KEYUP and event.key == PROFILER_TOGGLE_KEY:
+                allocation_profiler.toggle()
+            if event.type == pygame.KEYUP and event.key in (SAVE_KEY, RESTORE_KEY):
+                world.requested_keys.append(event.key)
+
+        # Passing the input over to the simulation thread
+        simulation.set_input(pygame.key.get_pressed(), latency_monitor.input_count)
+        allocation_profiler.end_phase("input")
+
+        # Win/Lose conditions are checked by the simulation and passed back in the snapshot
+        snapshot = snapshots.latest()
+        if snapshot.end_message is not None:
+            allocation_profiler.end_frame()
+            simulation.stop()
+            return end_game_screen(snapshot.end_message)
 
         # Drawing frame onto the screen
-        WINDOW.blit(BACKGROUND_IMAGE, (0, 0))
-        for asteroid in SolidObject.asteroids:
-            asteroid.draw_sprite()
-        for star in SolidObject.stars:
-            star.draw_sprite()
-        player_one.draw()
-        if two_player:
-            player_two.draw()
-        else:
-            draw_text("Score: {}".format(player_one.score), (0, 0), SCORE_FONT, WHITE)
-        pygame.display.update()
-
-        # set the max frames per seconds
+        draw_snapshot(snapshot)
+        allocation_profiler.end_phase("drawing")
+        latency_monitor.update_display("play_game", snapshot.last_input)
+        allocation_profiler.end_phase("display")
+        allocation_profiler.end_frame()
         clock.tick(FPS)
 
 
+def draw_snapshot(snapshot):
+    """
+   Draws a frame onto the pygame window from a snapshot of the world (instead of from the live objects).
+   :param snapshot: The WorldSnapshot to draw
+   """
+    WINDOW.blit(BACKGROUND_IMAGE, (0, 0))
+    for asteroid_x, asteroid_y in snapshot.asteroids:
+        WINDOW.blit(ASTEROID_SPRITE, centre_align(asteroid_x, asteroid_y, ASTEROID_WIDTH, ASTEROID_HEIGHT,
+                                                  ASTEROID_SPRITE_WIDTH, ASTEROID_SPRITE_HEIGHT))
+    for star_x, star_y in snapshot.stars:
+        WINDOW.blit(STAR_SPRITE, (star_x, star_y))
+    for player in snapshot.players:
+        username_size = USERNAME_FONT.size(player.username)
+        username_x = player.x + (PLAYER_WIDTH - username_size[0]) // 2
+        username_y = player.y - username_size[1] - 10
+        draw_text(player.username, (username_x, username_y), USERNAME_FONT, WHITE)
+        WINDOW.blit(player.sprite, centre_align(player.x, player.y, PLAYER_WIDTH, PLAYER_HEIGHT, PLAYER_SPRITE_WIDTH,
+                                                PLAYER_SPRITE_HEIGHT))
+    if not snapshot.two_player:
+        draw_text("Score: {}".format(snapshot.score), (0, 0), SCORE_FONT, WHITE)
+    draw_status(snapshot.status_message)
+
+
+def draw_status(message):
+    """
+   Draws a status message (e.g. "Game saved") at the bottom of the pygame window.
+   :param message: The message to draw, or None to draw nothing
+   """
+    if message is not None:
+        draw_text(message, (10, SCREEN_HEIGHT - USERNAME_FONT.get_linesize() - 10), USERNAME_FONT, YELLOW)
+
+
 def generate_asteroid_wave(wave_y_pos, asteroid_quantity, spawn_stars):
     """
    Generates a row of asteroids that all have the same y-position, but have randomised x-positions. Each asteroid has
@@ -614,7 +1314,7 @@ def end_game_screen(message):
     looping = True
     while looping:
         mouse_pressed = False
-        for event in pygame.event.get():
+        for event in latency_monitor.get_events():
             if event.type == pygame.QUIT:
                 quit()
             if event.type == pygame.MOUSEBUTTONUP:
@@ -638,7 +1338,7 @@ def end_game_screen(message):
         for button in Button.buttons:
             button.draw()
         WINDOW.blit(MOUSE_SPRITE, mouse_pos)
-        pygame.display.update()
+        latency_monitor.update_display("end_game_screen")
 
 
 def main():
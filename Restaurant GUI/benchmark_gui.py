@@ -0,0 +1,188 @@
+# Benchmarks for the food ordering GUI, run without a display (QT_QPA_PLATFORM=offscreen).
+# Times building the window, building tabs of synthetic menus of increasing size, switching tabs, and adding an item
+# to (and undoing and redoing it in) orders that already hold 10, 1,000 and 10,000 items. Each result is compared
+# against the baselines stored in benchmark_baselines.json and the script exits with status 1 if anything is slower
+# than its baseline allows.
+#
+#     python benchmark_gui.py                     compare against the stored baselines
+#     python benchmark_gui.py --update-baselines  store the results as the new baselines
+
+import os
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtCore import QThreadPool
+
+import food_ordering2
+from catalog import OrderItem, load_catalog, CATALOG_PATH
+from order_journal import OrderJournal
+from theme import Theme
+
+BASELINES_PATH = "benchmark_baselines.json"
+MENU_SIZES = [10, 100, 1000]  # flavours in the synthetic tab
+BASKET_SIZES = [10, 1000, 10000]
+REPEATS = 9
+TOLERANCE = 0.5  # how much slower than its baseline (as a fraction) a result can be before it is a regression
+SLACK_MS = 1.0  # plus this much, so that timer noise on very quick benchmarks isn't reported as a regression
+
+
+def synthetic_catalog(flavour_count):
+    """
+    Return the real catalog with an extra tab that has flavour_count flavours split across a few options.
+    """
+    catalog = load_catalog(CATALOG_PATH)
+    option_count = max(1, flavour_count // 50)
+    options = []
+    for option_number in range(option_count):
+        flavours = ["Item {}-{}".format(option_number, number) for number in range(flavour_count // option_count)]
+        options.append({"id": "synthetic{}".format(option_number), "header": "SYNTHETIC {}".format(option_number),
+                        "flavours": flavours, "exclusive": option_number % 2 == 0, "kind": "item", "suffix": "",
+                        "prices": {flavour: 1.0 for flavour in flavours}})
+    catalog["tabs"].append({"id": "synthetic", "title": "Synthetic", "header": "SYNTHETIC MENU",
+                            "image_path": "pizza.png", "description": "{} generated items".format(flavour_count),
+                            "options": options})
+    return catalog
+
+
+class Benchmark(object):
+    def __init__(self, app, theme, work_directory):
+        self.app = app
+        self.theme = theme
+        self.journal_path = os.path.join(work_directory, "orders.db")
+        self.catalog_path = os.path.join(work_directory, "catalog.json")
+        self.results = {}  # name -> median milliseconds
+
+    def time_it(self, name, function, setup=None, repeats=REPEATS):
+        """
+        Time function (after processing the events it causes) repeats times and record the median.
+        setup, if given, is called before each repeat (untimed) and its result is passed to function.
+        """
+        times = []
+        for repeat in range(repeats):
+            argument = setup() if setup is not None else None
+            self.app.processEvents()
+            started = time.perf_counter()
+            function(argument)
+            self.app.processEvents()
+            times.append((time.perf_counter() - started) * 1000)
+        self.results[name] = statistics.median(times)
+
+    def make_window(self, catalog_path=CATALOG_PATH):
+        window = food_ordering2.FoodOrderGUI(self.theme, OrderJournal(self.journal_path), catalog_path)
+        self.windows.append(window)
+        return window
+
+    def close_windows(self):
+        QThreadPool.globalInstance().waitForDone()
+        self.app.processEvents()
+        for window in self.windows:
+            window.close()
+            window.deleteLater()
+        self.windows = []
+        self.app.processEvents()
+
+    def run(self):
+        self.windows = []
+
+        # Building the whole window (only the first tab is built straight away)
+        self.time_it("construct window", lambda unused: self.make_window())
+        self.close_windows()
+
+        # Building a tab for the first time, then switching between built tabs
+        for size in MENU_SIZES:
+            catalog = synthetic_catalog(size)
+            with open(self.catalog_path, "w") as catalog_file:
+                json.dump(catalog, catalog_file)
+            synthetic_tab = len(catalog["tabs"]) - 1
+            self.time_it("build tab of {} items".format(size),
+                         lambda window: window.tab_bar.setCurrentIndex(synthetic_tab),
+                         setup=lambda: self.make_window(self.catalog_path))
+            window = self.windows[-1]
+            tabs = list(range(len(catalog["tabs"])))
+            for index in tabs:
+                window.tab_bar.setCurrentIndex(index)
+            self.time_it("switch tabs with {} items".format(size),
+                         lambda unused: [window.tab_bar.setCurrentIndex(index) for index in tabs + [0]])
+            self.close_windows()
+
+        # Adding to an order that is already big
+        window = self.make_window()
+        window.options["crust"]["buttongroup"].buttons()[0].setChecked(True)
+        window.options["toppings"]["buttongroup"].buttons()[0].setChecked(True)
+        filler = OrderItem("wings", "Buffalo", (), "Buffalo Wings")
+        for size in BASKET_SIZES:
+            window.apply_edit(window.order_history.add([filler] * (size - window.order_history.size())))
+            window.order_model.flush()
+            self.time_it("add to order of {} items".format(size),
+                         lambda unused: window.add_tab_to_order(window.tabs_info[0]), repeats=REPEATS * 4)
+            self.time_it("undo and redo in order of {} items".format(size),
+                         lambda unused: (window.undo(), window.redo(), window.order_model.flush()),
+                         repeats=REPEATS * 4)
+        self.close_windows()
+        return self.results
+
+
+def compare(results, baselines, tolerance):
+    """
+    Print each result next to its baseline and return the names of the ones that regressed.
+    """
+    regressions = []
+    print("{:<40} {:>10} {:>10} {:>8}".format("benchmark", "ms", "baseline", "change"))
+    for name, milliseconds in results.items():
+        baseline = baselines.get(name)
+        if baseline is None:
+            print("{:<40} {:>10.2f} {:>10} {:>8}".format(name, milliseconds, "-", "new"))
+            continue
+        change = milliseconds / baseline - 1 if baseline else 0
+        status = ""
+        if milliseconds > baseline * (1 + tolerance) + SLACK_MS:
+            regressions.append(name)
+            status = "  REGRESSION"
+        print("{:<40} {:>10.2f} {:>10.2f} {:>+7.0%}{}".format(name, milliseconds, baseline, change, status))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offscreen benchmarks for the food ordering GUI")
+    parser.add_argument("--update-baselines", action="store_true", help="store the results as the new baselines")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="allowed slowdown as a fraction of the baseline (default {})".format(TOLERANCE))
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+    theme = Theme(food_ordering2.style_sheet)
+    theme.apply_to_application(app)
+
+    work_directory = tempfile.mkdtemp()
+    try:
+        results = Benchmark(app, theme, work_directory).run()
+    finally:
+        shutil.rmtree(work_directory)
+
+    if args.update_baselines:
+        with open(BASELINES_PATH, "w") as baselines_file:
+            json.dump({name: round(milliseconds, 3) for name, milliseconds in results.items()}, baselines_file,
+                      indent=4)
+        print("Stored {} baselines in {}".format(len(results), BASELINES_PATH))
+        return
+
+    baselines = {}
+    if os.path.exists(BASELINES_PATH):
+        with open(BASELINES_PATH) as baselines_file:
+            baselines = json.load(baselines_file)
+    regressions = compare(results, baselines, args.tolerance)
+    if regressions:
+        print("{} benchmark(s) slower than their baseline allows: {}".format(len(regressions), ", ".join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
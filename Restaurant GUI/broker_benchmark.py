@@ -0,0 +1,116 @@
+# Load benchmark for order_broker.py.
+# Starts a broker in its own process (or uses one that is already running), then simulates many ordering terminals
+# over loopback. Each terminal sends an order, waits for the acknowledgement and sends the next one. Kitchen displays
+# are connected as well so that the fan-out is part of the measurement. Reports throughput and acknowledgement latency.
+
+import os
+import sys
+import math
+import time
+import json
+import asyncio
+import argparse
+import subprocess
+
+from order_broker import BROKER_HOST, connect, encode
+
+SAMPLE_ORDER_ITEMS = [
+    {"category": "crust", "name": "Flat", "extras": ["Pepperoni", "Mushroom"], "label": "Flat Pizza"},
+    {"category": "wings", "name": "Buffalo", "extras": [], "label": "Buffalo Wings"},
+    {"category": "drinks", "name": "Lemonade", "extras": [], "label": "Lemonade"}
+]
+
+
+def percentile(sorted_values, fraction):
+    rank = max(math.ceil(fraction * len(sorted_values)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+async def run_terminal(terminal_number, host, port, orders, latencies):
+    reader, writer = await connect("terminal", host, port)
+    for order_number in range(orders):
+        order = {"id": "{}-{}".format(terminal_number, order_number), "created": time.time(),
+                 "items": SAMPLE_ORDER_ITEMS}
+        sent_at = time.perf_counter()
+        writer.write(encode({"type": "order", "order": order}))
+        ack = json.loads(await reader.readline())
+        latencies.append(time.perf_counter() - sent_at)
+        if ack["type"] != "ack" or ack["id"] != order["id"]:
+            raise RuntimeError("Order wasn't acknowledged: {}".format(ack))
+    writer.close()
+
+
+async def run_kitchen(host, port, expected_orders, received):
+    reader, writer = await connect("kitchen", host, port)
+    while received[0] < expected_orders:
+        if not await reader.readline():
+            break
+        received[0] += 1
+    writer.close()
+
+
+async def wait_for_broker(host, port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.05)
+
+
+async def run_benchmark(host, port, terminals, orders, kitchens):
+    await wait_for_broker(host, port)
+    expected_orders = terminals * orders
+    kitchen_counts = [[0] for i in range(kitchens)]
+    kitchen_tasks = [asyncio.ensure_future(run_kitchen(host, port, expected_orders, count))
+                     for count in kitchen_counts]
+    await asyncio.sleep(0.1)  # let the kitchens say hello before the first order
+
+    latencies = []
+    started = time.perf_counter()
+    await asyncio.gather(*[run_terminal(number, host, port, orders, latencies) for number in range(terminals)])
+    elapsed = time.perf_counter() - started
+    await asyncio.wait_for(asyncio.gather(*kitchen_tasks), timeout=30)
+
+    latencies.sort()
+    print("{} terminals x {} orders, {} kitchen displays".format(terminals, orders, kitchens))
+    print("  throughput: {:.0f} orders/s ({} orders in {:.2f}s)".format(expected_orders / elapsed, expected_orders,
+                                                                       elapsed))
+    print("  ack latency: p50 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms".format(
+        percentile(latencies, 0.50) * 1000, percentile(latencies, 0.99) * 1000, latencies[-1] * 1000))
+    print("  orders received by each kitchen display: {}".format([count[0] for count in kitchen_counts]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load benchmark for the order broker")
+    parser.add_argument("--host", default=BROKER_HOST)
+    parser.add_argument("--port", type=int, default=8767)
+    parser.add_argument("--terminals", type=int, default=200)
+    parser.add_argument("--orders", type=int, default=50, help="orders sent by each terminal")
+    parser.add_argument("--kitchens", type=int, default=2)
+    parser.add_argument("--external", action="store_true", help="use a broker that is already running")
+    args = parser.parse_args()
+    for name in ["terminals", "orders", "kitchens"]:
+        if getattr(args, name) < 1:
+            # With no kitchen displays the broker refuses every order, and with no orders there is nothing to time
+            parser.error("--{} must be at least 1".format(name))
+
+    broker_process = None
+    if not args.external:
+        broker_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "order_broker.py")
+        broker_process = subprocess.Popen([sys.executable, broker_path, "--host", args.host,
+                                           "--port", str(args.port)], stdout=subprocess.DEVNULL)
+    try:
+        asyncio.run(run_benchmark(args.host, args.port, args.terminals, args.orders, args.kitchens))
+    finally:
+        if broker_process is not None:
+            broker_process.terminate()
+            broker_process.wait()
+
+
+if __name__ == '__main__':
+    main()
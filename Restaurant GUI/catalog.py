@@ -0,0 +1,37 @@
+# The menu catalog of the food ordering GUI and the line items that orders are made of.
+# Nothing in here depends on Qt, so it can be shared by the GUI and by command line tools.
+
+import json
+from collections import namedtuple
+
+# The menu is loaded from this file. See load_catalog() for its layout.
+CATALOG_PATH = "menu_catalog.json"
+
+# A line item in the order. category is the option it was chosen from (e.g. "crust" or "drinks"), name is the text of
+# the radio button, extras is a tuple of toppings etc. and label is how the item is shown in the order
+OrderItem = namedtuple("OrderItem", ["category", "name", "extras", "label"])
+
+
+def load_catalog(catalog_path=CATALOG_PATH):
+    """
+    Load the menu catalog from a JSON file. The catalog has a list of "tabs", each with an "id", a "title" for the
+    tab bar, a "header", "image_path", "description" and a list of "options". Each option has an "id", a "header",
+    a list of "flavours" and "exclusive" (whether only one flavour can be chosen). An option's "kind" is either
+    "item" (each flavour chosen is its own line item, labelled with the flavour plus an optional "suffix") or "extra"
+    (the flavours chosen are added to the first item chosen on the same tab, like toppings on a pizza).
+
+    Each option can also have "prices", mapping flavours to prices (for an "extra" option, the surcharge per flavour),
+    and the catalog can have a list of "combos", each with a "name", the "options" it is made of (one item from each)
+    and the "discount" it gives.
+    """
+    with open(catalog_path, encoding="utf-8") as catalog_file:
+        catalog = json.load(catalog_file)
+
+    for tab in catalog["tabs"]:
+        for option in tab["options"]:
+            option.setdefault("exclusive", True)
+            option.setdefault("kind", "item")
+            option.setdefault("suffix", "")
+            option.setdefault("prices", {})
+    catalog.setdefault("combos", [])
+    return catalog
@@ -3,15 +3,38 @@
 # I modified the listing by writing functions and methods which make it easier to add new tabs and menu items to the GUI
 # I also changed the colour-scheme and added some of my own menu items to the GUI
 
-# TODO - make a general "add to order" button that can be used for all tabs
-
 # import necessary modules
+import os
 import sys
+import hashlib
+import time
+import uuid
 from PyQt5.QtWidgets import (QApplication, QWidget, QTabWidget,
-                             QLabel, QRadioButton, QButtonGroup, QGroupBox, QPushButton,
-                             QVBoxLayout, QHBoxLayout, QGridLayout)
-from PyQt5.QtGui import QPixmap
-from PyQt5.QtCore import Qt
+                             QLabel, QRadioButton, QButtonGroup, QGroupBox, QPushButton, QListView,
+                             QLineEdit, QShortcut,
+                             QVBoxLayout, QHBoxLayout)
+from PyQt5.QtGui import QPixmap, QImage, QPixmapCache, QKeySequence
+from PyQt5.QtCore import (Qt, QAbstractListModel, QModelIndex, QTimer, QObject, QRunnable, QThreadPool, QSize,
+                          pyqtSignal)
+from order_submission import OrderSubmitter
+from order_journal import OrderJournal
+from catalog import CATALOG_PATH, load_catalog
+from order_engine import OrderEngine, OrderError
+from pricing import PriceTable, OrderTotal, format_price
+from menu_search import MenuSearchIndex
+from suggestions import CooccurrenceIndex, load_from_journal
+from order_history import OrderHistory
+from theme import Theme
+
+# Decoded images are shared through QPixmapCache (limited to this many KB) and their scaled thumbnails are kept on
+# disk in this directory between runs
+PIXMAP_CACHE_LIMIT_KB = 20 * 1024
+THUMBNAIL_CACHE_DIR = ".thumbnail_cache"
+
+# The style sheet is compiled into per-widget palettes and scoped style sheets (see theme.py) unless
+# --global-stylesheet is given, and --measure-style prints how long styling took
+GLOBAL_STYLESHEET = "--global-stylesheet" in sys.argv
+MEASURE_STYLE = "--measure-style" in sys.argv
 
 # Set up style sheet for the entire GUI
 style_sheet = """
@@ -49,6 +72,13 @@ style_sheet = """
         padding-left: 10px;
         color: #e61838
     }
+    QListView{
+        background-color: #EFD096;
+        border-width: 2px;
+        border-style: solid;
+        border-radius: 4px;
+        border-color: #EFD096
+    }
     QLabel#ImageInfo{
         background-color: #FCF9F3;
         border-radius: 4px
@@ -57,6 +87,11 @@ style_sheet = """
         background-color: #FCEBCD;
         color: #e61838
     }
+    QLineEdit{
+        background-color: #FCF9F3;
+        border-radius: 4px;
+        padding: 4px
+    }
     QRadioButton{
         background-color: #FCF9F3
     }
@@ -75,10 +110,173 @@ style_sheet = """
 """
 
 
+class ImageLoadSignals(QObject):
+    """
+    Signals for ImageLoadTask (QRunnable isn't a QObject, so it can't have signals of its own).
+    """
+    loaded = pyqtSignal(str, QImage)
+    failed = pyqtSignal(str)
+
+
+class ImageLoadTask(QRunnable):
+    """
+    Decode and scale an image on a QThreadPool thread. The scaled thumbnail is read from or saved to the disk cache,
+    keyed by the path, modification time and size of the source file and the size of the thumbnail.
+    """
+
+    def __init__(self, cache_key, img_path, size):
+        super().__init__()
+        self.cache_key = cache_key
+        self.img_path = img_path
+        self.size = size
+        self.signals = ImageLoadSignals()
+
+    def run(self):
+        try:
+            stat = os.stat(self.img_path)
+        except OSError:
+            self.signals.failed.emit(self.cache_key)
+            return
+
+        source_id = "{}|{}|{}|{}x{}".format(os.path.abspath(self.img_path), stat.st_mtime_ns, stat.st_size,
+                                            self.size.width(), self.size.height())
+        thumbnail_path = os.path.join(THUMBNAIL_CACHE_DIR, hashlib.sha1(source_id.encode()).hexdigest() + ".png")
+
+        # QImage (unlike QPixmap) can be used outside of the GUI thread
+        image = QImage(thumbnail_path)
+        if image.isNull():
+            image = QImage(self.img_path)
+            if image.isNull():
+                self.signals.failed.emit(self.cache_key)
+                return
+            image = image.scaled(self.size, Qt.KeepAspectRatioByExpanding, Qt.SmoothTransformation)
+            os.makedirs(THUMBNAIL_CACHE_DIR, exist_ok=True)
+            image.save(thumbnail_path)
+        self.signals.loaded.emit(self.cache_key, image)
+
+
+class SuggestionLoadSignals(QObject):
+    """
+    Signals for SuggestionLoadTask.
+    """
+    loaded = pyqtSignal(object)
+
+
+class SuggestionLoadTask(QRunnable):
+    """
+    Build the "frequently ordered together" index from the order journal on a QThreadPool thread, counting the
+    submitted orders up to the mark last_order.
+    """
+
+    def __init__(self, catalog, order_journal, last_order):
+        super().__init__()
+        self.catalog = catalog
+        self.order_journal = order_journal
+        self.last_order = last_order
+        self.signals = SuggestionLoadSignals()
+
+    def run(self):
+        suggestion_index = CooccurrenceIndex(self.catalog)
+        load_from_journal(suggestion_index, self.order_journal, self.last_order)
+        self.signals.loaded.emit(suggestion_index)
+
+
+class OrderModel(QAbstractListModel):
+    """
+    List model of the line items in the order. Items that are added in the same pass of the event loop are inserted
+    as a single batch of rows, so views only relayout once however many items are added.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.items = []
+        self.pending_items = []
+
+        # Zero-interval single shot timer fires once control returns to the event loop
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(0)
+        self.flush_timer.timeout.connect(self.flush)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.items)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        item = self.items[index.row()]
+        if role == Qt.DisplayRole:
+            if item.extras:
+                return item.label + " (" + ", ".join(item.extras) + ")"
+            return item.label
+        if role == Qt.ToolTipRole and item.extras:
+            return item.label + "\n" + "\n".join(item.extras)
+        return None
+
+    def add_item(self, item):
+        """
+        Queue an item to be added to the order the next time control returns to the event loop.
+        """
+        self.pending_items.append(item)
+        if not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    def flush(self):
+        """
+        Insert all of the queued items as one batch of rows.
+        """
+        if not self.pending_items:
+            return
+        first_row = len(self.items)
+        self.beginInsertRows(QModelIndex(), first_row, first_row + len(self.pending_items) - 1)
+        self.items.extend(self.pending_items)
+        self.pending_items = []
+        self.endInsertRows()
+
+    def insert_items(self, row, items):
+        """
+        Insert items at row. Items added to the end are queued like add_item, anywhere else they are inserted now.
+        """
+        if row == len(self.items) + len(self.pending_items):
+            for item in items:
+                self.add_item(item)
+            return
+        self.flush()
+        self.beginInsertRows(QModelIndex(), row, row + len(items) - 1)
+        self.items[row:row] = items
+        self.endInsertRows()
+
+    def remove_items(self, row, count):
+        """
+        Remove count items starting at row.
+        """
+        self.flush()
+        self.beginRemoveRows(QModelIndex(), row, row + count - 1)
+        del self.items[row:row + count]
+        self.endRemoveRows()
+
+    def clear(self):
+        """
+        Remove every item (including queued ones) from the order.
+        """
+        self.beginResetModel()
+        self.items = []
+        self.pending_items = []
+        self.endResetModel()
+
+
 class FoodOrderGUI(QWidget):
 
-    def __init__(self):
+    def __init__(self, theme, order_journal=None, catalog_path=CATALOG_PATH):
         super().__init__()
+        self.theme = theme
+        self.catalog_path = catalog_path
+        self.waiting_image_labels = {}  # pixmap cache key -> list of QLabels showing a placeholder for that image
+        self.order_journal = order_journal or OrderJournal()
+        self.order_id = uuid.uuid4().hex
+        self.order_history = OrderHistory()
         self.initialize_ui()
 
     def initialize_ui(self):
@@ -90,123 +288,49 @@ class FoodOrderGUI(QWidget):
 
         self.create_hierarchy()
         self.setup_tabs_and_layout()
+        self.theme.apply(self)
 
         self.show()
 
     def create_hierarchy(self):
-        """Create hierarchy structure using dictionaries (including all necessary
-            QGroupBoxes and QButtonGroups"""
-        self.crust_groupbox = QGroupBox()
-        self.toppings_groupbox = QGroupBox()
-        self.wings_groupbox = QGroupBox()
-        self.sides_groupbox = QGroupBox()
-        self.drinks_groupbox = QGroupBox()
-
-        self.crust_buttongroup = QButtonGroup()
-        self.toppings_buttongroup = QButtonGroup()
-        self.wings_buttongroup = QButtonGroup()
-        self.sides_buttongroup = QButtonGroup()
-        self.drinks_buttongroup = QButtonGroup()
-
-        self.choose_crust = {
-            "header": "CHOOSE YOUR CRUST",
-            "flavours": ["Hand-Tossed", "Flat", "Stuffed"],
-            "groupbox": self.crust_groupbox,
-            "buttongroup": self.crust_buttongroup,
-            "exclusive": True
-        }
-
-        self.choose_toppings = {
-            "header": "CHOOSE YOUR TOPPINGS",
-            "flavours": ["Pepperoni", "Sausage", "Bacon", "Canadian Bacon",
-                         "Beef", "Pineapple", "Mushroom", "Onion",
-                         "Olive", "Green Pepper", "Tomato", "Spinach", "Cheese"],
-            "groupbox": self.toppings_groupbox,
-            "buttongroup": self.toppings_buttongroup,
-            "exclusive": False
-        }
-
-        self.choose_wings = {
-            "header": "CHOOSE YOUR FLAVOUR",
-            "flavours": ["Buffalo", "Sweet-Sour", "Teriyaki", "Barbecue"],
-            "groupbox": self.wings_groupbox,
-            "buttongroup": self.wings_buttongroup,
-            "exclusive": True
-        }
-
-        self.choose_sides = {
-            "header": "CHOOSE YOUR SIDE",
-            "flavours": ["Fries", "Hash Browns", "Salad", "Choc Chip Cookie"],
-            "groupbox": self.sides_groupbox,
-            "buttongroup": self.sides_buttongroup,
-            "exclusive": True
-        }
-
-        self.choose_drinks = {
-            "header": "CHOOSE A DRINK",
-            "flavours": ["Orange Juice", "Lemonade", "Protein Shake", "Chocolate Milk"],
-            "groupbox": self.drinks_groupbox,
-            "buttongroup": self.drinks_buttongroup,
-            "exclusive": True
-        }
-
-        self.pizza_tab_info = {
-            "header": "BUILD YOUR OWN PIZZA",
-            "image_path": "pizza.png",
-            "description": "Build a custom pizza for you. Start with your favorite crust and add any toppings,"
-                           " plus the perfect amount of cheese and sauce.",
-            "options": [self.choose_crust, self.choose_toppings],
-            "order_button": QPushButton("Add to order"),
-            "add_to_order_func": self.display_pizza_in_order
-        }
-        self.wings_tab_info = {
-            "header": "TRY OUR DELICIOUS WINGS",
-            "image_path": "wings.png",
-            "description": "6 pieces of rich-tasting, white meat chicken that will have you coming back for more.",
-            "options": [self.choose_wings],
-            "order_button": QPushButton("Add to order"),
-            "add_to_order_func": self.display_wings_in_order
-        }
-        self.sides_tab_info = {
-            "header": "TOP IT OFF WITH SOME IRRESISTIBLE SIDES",
-            "image_path": "sides.png",
-            "description": "No meal is complete without a lil something extra on the side.",
-            "options": [self.choose_sides, self.choose_drinks],
-            "order_button": QPushButton("Add to order"),
-            "add_to_order_func": self.display_sides_in_order
-        }
+        """Create hierarchy structure using dictionaries loaded from the menu catalog. The QGroupBoxes and
+            QButtonGroups for each option are only created when its tab is built"""
+        self.catalog = load_catalog(self.catalog_path)
+        self.tabs_info = self.catalog["tabs"]
+        self.options = {option["id"]: option for tab_info in self.tabs_info for option in tab_info["options"]}
+        self.order_engine = OrderEngine(self.catalog)
+        self.price_table = PriceTable(self.catalog)
+        self.order_total = OrderTotal(self.price_table)
+        self.search_index = MenuSearchIndex(self.catalog)
+        # The suggestion index is loaded from the order journal in the background. Until then suggestions only come
+        # from the orders submitted since startup, and those are counted again in the loaded index
+        self.suggestion_index = CooccurrenceIndex(self.catalog)
+        self.orders_while_loading = []  # line items of the orders submitted before the index was loaded
+        task = SuggestionLoadTask(self.catalog, self.order_journal, self.order_journal.last_submitted())
+        task.signals.loaded.connect(self.set_suggestion_index)
+        QThreadPool.globalInstance().start(task)
+        self.search_results = None
 
     def setup_tabs_and_layout(self):
         """
         Creates structure for the tabs and layout for the main window. Set up tab bar and different tab widgets.
         Also, create the side widget to display items selected.
         """
-        # Create tab bar, different tabs and set object names
+        # Create tab bar and an empty widget for each tab. The contents of a tab are only built the first time it is
+        # shown (see build_tab)
         self.tab_bar = QTabWidget(self)
+        for tab_info in self.tabs_info:
+            tab = QWidget()
 
-        self.pizza_tab = QWidget()
-        self.wings_tab = QWidget()
-        self.sides_tab = QWidget()
-
-        # use setObjectName("Tabs") so that the stylesheet can distinguish QWidgets which are meant to act as tabs from
-        # other QWidgets
-        self.pizza_tab.setObjectName("Tabs")
-        self.wings_tab.setObjectName("Tabs")
-        self.sides_tab.setObjectName("Tabs")
-
-        self.tab_bar.addTab(self.pizza_tab, "Pizza")
-        self.tab_bar.addTab(self.wings_tab, "Wings")
-        self.tab_bar.addTab(self.sides_tab, "Sides and Drink")
-
-        # Create the child widgets and place them in a layout for each tab
-        pizza_tab_layout = self.make_tab(self.pizza_tab_info)
-        wings_tab_layout = self.make_tab(self.wings_tab_info)
-        sides_tab_layout = self.make_tab(self.sides_tab_info)
+            # use setObjectName("Tabs") so that the stylesheet can distinguish QWidgets which are meant to act as tabs
+            # from other QWidgets
+            tab.setObjectName("Tabs")
+            tab_info["widget"] = tab
+            tab_info["built"] = False
+            self.tab_bar.addTab(tab, tab_info["title"])
 
-        # assign the layouts to the tabs
-        self.pizza_tab.setLayout(pizza_tab_layout)
-        self.wings_tab.setLayout(wings_tab_layout)
-        self.sides_tab.setLayout(sides_tab_layout)
+        self.tab_bar.currentChanged.connect(self.build_tab)
+        self.build_tab(self.tab_bar.currentIndex())
 
         # Set up side widget which is not part of the tab widget
         self.side_widget = QWidget()
@@ -214,47 +338,126 @@ class FoodOrderGUI(QWidget):
         order_label = QLabel("YOUR ORDER")
         order_label.setObjectName("Header")
 
-        items_box = QWidget()
-        items_box.setObjectName("Side")
-        pizza_label = QLabel("Pizza Type: ")
-        self.display_pizza_label = QLabel("")
-        toppings_label = QLabel("Toppings: ")
-        self.display_toppings_label = QLabel("")
-        extra_label = QLabel("Extra: ")
-        self.display_wings_label = QLabel("")
-
-        # Set grid layout for objects in side widget
-        items_grid = QGridLayout()
-        items_grid.addWidget(pizza_label, 0, 0, Qt.AlignRight)  # x = 0, y = 0, alignment = right
-        items_grid.addWidget(self.display_pizza_label, 0, 1)  # x = 0, y = 1, no alignment
-        items_grid.addWidget(toppings_label, 1, 0, Qt.AlignRight)
-        items_grid.addWidget(self.display_toppings_label, 1, 1)
-        items_grid.addWidget(extra_label, 2, 0, Qt.AlignRight)
-        items_grid.addWidget(self.display_wings_label, 2, 1)
-        items_box.setLayout(items_grid)
+        # The order is kept in a model and shown by a list view, which only lays out and paints the visible rows
+        # (every row is a single line, so the view doesn't have to measure each one). Removing rows makes the view lay
+        # out the whole list again, so it does that in batches between events instead of all at once
+        self.order_model = OrderModel(self)
+        self.order_view = QListView()
+        self.order_view.setModel(self.order_model)
+        self.order_view.setUniformItemSizes(True)
+        self.order_view.setLayoutMode(QListView.Batched)
+
+        # Orders are sent to the kitchen in the background, and the outcome is shown in the status label
+        self.order_submitter = OrderSubmitter(parent=self)
+        self.order_submitter.sent.connect(self.show_order_sent)
+        self.order_submitter.retrying.connect(self.show_order_retrying)
+        self.order_submitter.failed.connect(self.show_order_failed)
+        # Orders that were still waiting to be sent when the GUI was last closed are sent again (the kitchen ignores
+        # any that it did get)
+        unsent_orders = self.order_journal.take_unsent_orders()
+        for order in unsent_orders:
+            self.order_submitter.submit(order)
+        submit_button = QPushButton("Submit order")
+        submit_button.clicked.connect(self.submit_order)
+
+        # Items can be removed from the order, and every change to it can be undone and redone
+        self.remove_button = QPushButton("Remove item")
+        self.remove_button.clicked.connect(self.remove_selected_item)
+        self.undo_button = QPushButton("Undo")
+        self.undo_button.clicked.connect(self.undo)
+        self.redo_button = QPushButton("Redo")
+        self.redo_button.clicked.connect(self.redo)
+        QShortcut(QKeySequence.Undo, self, self.undo)
+        QShortcut(QKeySequence.Redo, self, self.redo)
+        self.update_history_buttons()
+        edit_h_box = QHBoxLayout()
+        edit_h_box.addWidget(self.remove_button)
+        edit_h_box.addWidget(self.undo_button)
+        edit_h_box.addWidget(self.redo_button)
+
+        self.order_status_label = QLabel("")
+        self.total_label = QLabel("")
+        self.total_label.setObjectName("Header")
+        self.show_total()
+        self.order_status_label.setWordWrap(True)
+        if unsent_orders:
+            self.order_status_label.setText("Sending {} order(s) left over from last time...".format(
+                len(unsent_orders)))
+        # Items that are often ordered with the last item added are suggested below the order
+        self.suggestions_label = QLabel("")
+        self.suggestions_label.setWordWrap(True)
 
         # Set main layout for side widget (contains
         side_v_box = QVBoxLayout()
         side_v_box.addWidget(order_label)
-        side_v_box.addWidget(items_box)
-        side_v_box.addStretch()
+        side_v_box.addWidget(self.order_view)
+        side_v_box.addLayout(edit_h_box)
+        side_v_box.addWidget(self.suggestions_label)
+        side_v_box.addWidget(self.total_label)
+        side_v_box.addWidget(submit_button, alignment=Qt.AlignRight)
+        side_v_box.addWidget(self.order_status_label)
         self.side_widget.setLayout(side_v_box)
 
         # Add widgets to main window and set layout
+        # The search box filters the options on the tabs as the user types
+        self.search_box = QLineEdit()
+        self.search_box.setPlaceholderText("Search the menu")
+        self.search_box.setClearButtonEnabled(True)
+        self.search_box.textChanged.connect(self.filter_menu)
+        menu_v_box = QVBoxLayout()
+        menu_v_box.addWidget(self.search_box)
+        menu_v_box.addWidget(self.tab_bar)
+
         main_h_box = QHBoxLayout()
-        main_h_box.addWidget(self.tab_bar)
+        main_h_box.addLayout(menu_v_box)
         main_h_box.addWidget(self.side_widget)
 
         self.setLayout(main_h_box)
 
+    def build_tab(self, index):
+        """
+        Create the child widgets of a tab and place them in its layout, unless that has already been done.
+        """
+        if index < 0:
+            return
+        tab_info = self.tabs_info[index]
+        if tab_info["built"]:
+            return
+        tab_info["widget"].setLayout(self.make_tab(tab_info))
+        tab_info["built"] = True
+        self.theme.apply(tab_info["widget"])
+        self.apply_search(tab_info)
+
+    def filter_menu(self, text):
+        """
+        Show only the options that match the search box, on every tab that has been built (tabs that haven't been
+        built yet are filtered when they are).
+        """
+        self.search_results = self.search_index.search(text)
+        for tab_info in self.tabs_info:
+            if tab_info["built"]:
+                self.apply_search(tab_info)
+
+    def apply_search(self, tab_info):
+        """
+        Show or hide the existing radio buttons (and groupboxes) of a tab to match the current search results.
+        """
+        for option in tab_info["options"]:
+            any_visible = False
+            for flavour, button in option["buttons"].items():
+                visible = MenuSearchIndex.matches(self.search_results, option["id"], flavour)
+                if button.isHidden() == visible:
+                    button.setVisible(visible)
+                any_visible = any_visible or visible
+            if option["groupbox"].isHidden() == any_visible:
+                option["groupbox"].setVisible(any_visible)
+
     def make_tab(self, tab_info):
-        # get variables from tab dictionary. tab_info is something like self.pizza_tab_info or self.wings_tab_info
+        # get variables from tab dictionary. tab_info is one of the tabs from the menu catalog
         header_text = tab_info["header"]
         image_path = tab_info["image_path"]
         description = tab_info["description"]
         options = tab_info["options"]
-        order_button = tab_info["order_button"]
-        add_to_order_func = tab_info["add_to_order_func"]
 
         # Set up widgets and layouts to display information to the user about the page
         tab_header_label = QLabel(header_text)
@@ -277,8 +480,11 @@ class FoodOrderGUI(QWidget):
         tab_v_box.addWidget(tab_header_label)
         tab_v_box.addWidget(description_box)
         for option in options:
-            groupbox = option["groupbox"]
+            groupbox = QGroupBox()
             groupbox.setTitle(option["header"])
+            option["groupbox"] = groupbox
+            option["buttongroup"] = QButtonGroup(self)
+            option["buttons"] = {}
 
             # create radio buttons for each flavour and add each to both a QVBoxLayout (and the buttongroup)
             groupbox_v_layout = QVBoxLayout()
@@ -286,6 +492,7 @@ class FoodOrderGUI(QWidget):
                 flavor_rb = QRadioButton(flavour)
                 groupbox_v_layout.addWidget(flavor_rb)
                 option["buttongroup"].addButton(flavor_rb)  # (and the buttongroup)
+                option["buttons"][flavour] = flavor_rb
 
             if option["exclusive"] is False:
                 option["buttongroup"].setExclusive(False)  # allows more than one option to be selected
@@ -297,7 +504,8 @@ class FoodOrderGUI(QWidget):
             tab_v_box.addWidget(groupbox)
 
         # Create button to add information to side widget when clicked
-        order_button.clicked.connect(add_to_order_func)
+        order_button = QPushButton("Add to order")
+        order_button.clicked.connect(lambda: self.add_tab_to_order(tab_info))
         tab_v_box.addWidget(order_button, alignment=Qt.AlignRight)
         tab_v_box.addStretch()
 
@@ -306,92 +514,203 @@ class FoodOrderGUI(QWidget):
 
     def load_image(self, img_path):
         """
-        Load and scale images.
+        Create a label for an image. The image is loaded and scaled in the background and a placeholder is shown
+        until it is ready.
         """
-        try:
-            with open(img_path):
-                image = QLabel(self)
-                image.setObjectName("ImageInfo")
-                pixmap = QPixmap(img_path)
-                image.setPixmap(pixmap.scaled(image.size(), Qt.KeepAspectRatioByExpanding, Qt.SmoothTransformation))
-                return image
-        except FileNotFoundError:
-            print("Image not found.")
+        image = QLabel(self)
+        image.setObjectName("ImageInfo")
+        image.setAlignment(Qt.AlignCenter)
+        size = image.size()
+        cache_key = "{}@{}x{}".format(img_path, size.width(), size.height())
+
+        pixmap = QPixmapCache.find(cache_key)
+        if pixmap is not None:
+            image.setPixmap(pixmap)
+            return image
+
+        image.setText("Loading...")
+        if cache_key not in self.waiting_image_labels:
+            self.waiting_image_labels[cache_key] = []
+            task = ImageLoadTask(cache_key, img_path, QSize(size))
+            task.signals.loaded.connect(self.show_loaded_image)
+            task.signals.failed.connect(self.show_missing_image)
+            QThreadPool.globalInstance().start(task)
+        self.waiting_image_labels[cache_key].append(image)
+        return image
+
+    def show_loaded_image(self, cache_key, loaded_image):
+        """
+        Convert an image that has finished loading to a pixmap, cache it and show it in the labels waiting for it.
+        """
+        pixmap = QPixmap.fromImage(loaded_image)
+        QPixmapCache.insert(cache_key, pixmap)
+        for image in self.waiting_image_labels.pop(cache_key, []):
+            image.setPixmap(pixmap)
+
+    def show_missing_image(self, cache_key):
+        """
+        Replace the placeholder of an image that couldn't be loaded.
+        """
+        print("Image not found.")
+        for image in self.waiting_image_labels.pop(cache_key, []):
+            image.setText("Image not found.")
 
-    def collect_toppings_in_list(self):
+    def collect_checked_in_list(self, option):
         """
-        Create list of all checked toppings radio buttons.
+        Create list of the text of all checked radio buttons of an option.
         """
-        # what the fuck?
-        toppings_buttongroup = self.choose_toppings["buttongroup"]
-        toppings_list = [button.text() for i, button in enumerate(toppings_buttongroup.buttons()) if button.isChecked()]
-        return toppings_list
+        return [button.text() for button in option["buttongroup"].buttons() if button.isChecked()]
 
-    def display_pizza_in_order(self):
+    def add_tab_to_order(self, tab_info):
         """
         Collect the text from the radio buttons that are checked
-        on pizza page. Display text in side widget.
+        on a tab. Add the items they make up to the order.
         """
+        selections = {option["id"]: self.collect_checked_in_list(option) for option in tab_info["options"]}
         try:
-            crust_buttongroup = self.choose_crust["buttongroup"]
-            crust_text = crust_buttongroup.checkedButton().text()
-            self.display_pizza_label.setText(crust_text)
+            items = self.order_engine.build_items(tab_info["id"], selections)
+        except OrderError as error:
+            print(error)
+            return
 
-            toppings = self.collect_toppings_in_list()
-            toppings_str = '\n'.join(toppings)
-            self.display_toppings_label.setText(toppings_str)
-
-            self.repaint()
-        except AttributeError:
+        if not items:
             print("No value selected.")
-            pass
+            return
+        self.apply_edit(self.order_history.add(items))
+        self.show_suggestions(items)
 
-    def display_wings_in_order(self):
+    def remove_selected_item(self):
         """
-        Collect the text from the radio buttons that are checked
-        on wings page. Display text in side widget.
+        Remove the selected item from the order, or the last item if none is selected.
         """
-        try:
-            wings_buttongroup = self.choose_wings["buttongroup"]
-            text = wings_buttongroup.checkedButton().text() + " Wings"
-            old_text = self.display_wings_label.text()
-            new_text = old_text + "\n" + text
-            self.display_wings_label.setText(new_text)
-            self.repaint()
-        except AttributeError:
-            print("No value selected.")
-            pass
+        rows = self.order_view.selectionModel().selectedRows()
+        row = rows[0].row() if rows else self.order_history.size() - 1
+        if row < 0:
+            print("Order is empty.")
+            return
+        self.apply_edit(self.order_history.remove(row))
+
+    def undo(self):
+        edit = self.order_history.undo()
+        if edit is not None:
+            self.apply_edit(edit)
+
+    def redo(self):
+        edit = self.order_history.redo()
+        if edit is not None:
+            self.apply_edit(edit)
+
+    def apply_edit(self, edit):
+        """
+        Show a change to the order (an Edit from the order history): update the rows it changed, the journal and the
+        running total.
+        """
+        if edit.action == "add":
+            self.order_model.insert_items(edit.row, edit.items)
+            for item in edit.items:
+                self.order_journal.record(self.order_id, "add", item)
+                self.order_total.add(item)
+        else:
+            self.order_model.remove_items(edit.row, len(edit.items))
+            for item in edit.items:
+                self.order_journal.record(self.order_id, "remove", item)
+                self.order_total.remove(item)
+        self.suggestions_label.setText("")
+        self.show_total()
+        self.update_history_buttons()
+
+    def update_history_buttons(self):
+        self.undo_button.setEnabled(self.order_history.can_undo())
+        self.redo_button.setEnabled(self.order_history.can_redo())
+
+    def show_total(self):
+        """
+        Show the running total of the order, and the combo discount if there is one.
+        """
+        text = "Total: " + format_price(self.order_total.total)
+        if self.order_total.discount:
+            text += " (includes {} combo discount)".format(format_price(self.order_total.discount))
+        self.total_label.setText(text)
 
-    def display_sides_in_order(self):
+    def show_suggestions(self, items):
         """
-        Collect the text from the radio buttons that are checked
-        on sides page. Display text in side widget
+        Suggest items that are often ordered with the items just added, other than the kinds already in the order.
         """
-        try:
-            sides_buttongroup = self.choose_sides["buttongroup"]
-            text = sides_buttongroup.checkedButton().text()
-            old_text = self.display_wings_label.text()   # note display_wings_label is the 'extras' label
-            new_text = old_text + "\n" + text
-            self.display_wings_label.setText(new_text)
-            self.repaint()
-        except AttributeError:
-            print("No value selected.")
-            pass
+        ordered_options = {option_id for option_id, count in self.order_total.category_counts.items() if count > 0}
+        suggestions = self.suggestion_index.suggest(items, ordered_options)
+        if suggestions:
+            names = [flavour + self.options[option_id]["suffix"] for option_id, flavour in suggestions]
+            self.suggestions_label.setText("Often ordered with this: " + ", ".join(names))
+        else:
+            self.suggestions_label.setText("")
+
+    def set_suggestion_index(self, suggestion_index):
+        """
+        Start using a suggestion index that has finished loading, after counting the orders submitted meanwhile.
+        """
+        for items in self.orders_while_loading:
+            suggestion_index.add_order(items)
+        self.orders_while_loading = None
+        self.suggestion_index = suggestion_index
 
-        try:
-            drinks_buttongroup = self.choose_drinks["buttongroup"]
-            text = drinks_buttongroup.checkedButton().text()
-            old_text = self.display_wings_label.text()   # note display_wings_label is the 'extras' label
-            new_text = old_text + "\n" + text
-            self.display_wings_label.setText(new_text)
-            self.repaint()
-        except AttributeError:
-            print("No value selected.")
-            pass
+    def closeEvent(self, event):
+        """
+        Make sure everything recorded in the order journal is written before the window closes, and keep any orders
+        that haven't been sent to the kitchen yet so that they are sent the next time. The suggestion counts are kept
+        too (if they finished loading), so the next start only has to count the orders submitted after now.
+        """
+        self.order_journal.save_unsent_orders(self.order_submitter.stop())
+        self.order_journal.close()
+        if self.orders_while_loading is None:
+            self.order_journal.save_suggestion_counts(self.order_journal.last_submitted(),
+                                                      self.suggestion_index.counts())
+        super().closeEvent(event)
+
+    def submit_order(self):
+        """
+        Send the items in the order to the kitchen and start a new, empty order.
+        """
+        items = self.order_history.items()
+        if not items:
+            print("Order is empty.")
+            return
+
+        order = {
+            "id": self.order_id,
+            "created": time.time(),
+            "items": [dict(item._asdict(), extras=list(item.extras)) for item in items],
+            "total": self.order_total.total
+        }
+        self.order_submitter.submit(order)
+        self.order_journal.record_submitted(order["id"], order["total"])
+        self.suggestion_index.add_order(items)
+        if self.orders_while_loading is not None:
+            self.orders_while_loading.append(items)
+        self.suggestions_label.setText("")
+        self.order_model.clear()
+        self.order_id = uuid.uuid4().hex
+        self.order_history = OrderHistory()
+        self.order_total = OrderTotal(self.price_table)
+        self.show_total()
+        self.update_history_buttons()
+        self.order_status_label.setText("Sending order {}...".format(order["id"][:8]))
+
+    def show_order_sent(self, order_id):
+        self.order_status_label.setText("Order {} sent to the kitchen.".format(order_id[:8]))
+
+    def show_order_retrying(self, order_id, attempt, delay):
+        self.order_status_label.setText("Order {} not sent yet (attempt {}), retrying in {:.0f}s.".format(
+            order_id[:8], attempt, delay))
+
+    def show_order_failed(self, order_id, reason):
+        self.order_status_label.setText("Order {} could not be sent: {}".format(order_id[:8], reason))
 
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
-    app.setStyleSheet(style_sheet)
-    window = FoodOrderGUI()
+    QPixmapCache.setCacheLimit(PIXMAP_CACHE_LIMIT_KB)
+    theme = Theme(style_sheet, scoped=not GLOBAL_STYLESHEET, measure=MEASURE_STYLE)
+    theme.apply_to_application(app)
+    app.aboutToQuit.connect(theme.report)
+    window = FoodOrderGUI(theme)
     sys.exit(app.exec_())
@@ -0,0 +1,97 @@
+# A local stand-in for the kitchen's order endpoint, for testing order submission from the ordering GUI.
+# POST a JSON body of {"orders": [...]} to /orders and it replies with {"accepted": [ids of the orders]}.
+# --delay and --fail-rate make it slow or unreliable, to check that the GUI stays responsive and retries.
+# Like the real kitchen, it only cooks an order once: an order whose id it has already received (e.g. a retry of a
+# request that timed out after it was processed) is accepted again but not printed again.
+
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RECENT_ORDER_LIMIT = 100000  # how many order ids are remembered for spotting repeats
+
+
+class KitchenHandler(BaseHTTPRequestHandler):
+    delay = 0
+    fail_rate = 0
+    received_ids = set()
+    received_order = deque()  # the ids in received_ids, oldest first
+    received_lock = threading.Lock()
+
+    def do_POST(self):
+        if self.path != "/orders":
+            self.send_error(404)
+            return
+
+        time.sleep(self.delay)
+        if random.random() < self.fail_rate:
+            self.send_error(503, "Kitchen is busy")
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            orders = json.loads(self.rfile.read(length))["orders"]
+        except (ValueError, KeyError):
+            self.send_error(400, "Expected a JSON body with a list of orders")
+            return
+
+        for order in orders:
+            if not self.receive(order["id"]):
+                continue  # already cooked
+            items = ", ".join(item["label"] for item in order["items"])
+            print("Order {}: {}".format(order["id"], items))
+        sys.stdout.flush()
+
+        body = json.dumps({"accepted": [order["id"] for order in orders]}).encode()
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the terminal gave up waiting and will retry, which is why repeats are ignored
+
+    @classmethod
+    def receive(cls, order_id):
+        """
+        Remember an order id and return whether it is new.
+        """
+        with cls.received_lock:
+            if order_id in cls.received_ids:
+                return False
+            cls.received_ids.add(order_id)
+            cls.received_order.append(order_id)
+            if len(cls.received_order) > RECENT_ORDER_LIMIT:
+                cls.received_ids.discard(cls.received_order.popleft())
+            return True
+
+    def log_message(self, format, *args):
+        pass  # the orders themselves are printed instead
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in kitchen endpoint for the food ordering GUI")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=0, help="seconds to wait before answering each request")
+    parser.add_argument("--fail-rate", type=float, default=0, help="fraction of requests to answer with a 503")
+    args = parser.parse_args()
+
+    KitchenHandler.delay = args.delay
+    KitchenHandler.fail_rate = args.fail_rate
+    server = ThreadingHTTPServer((args.host, args.port), KitchenHandler)
+    print("Kitchen listening on http://{}:{}/orders".format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
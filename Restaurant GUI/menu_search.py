@@ -0,0 +1,83 @@
+# Live search over the options in the menu catalog.
+# Flavours and option headers are indexed separately by all of the 1, 2 and 3 character substrings of their text. A
+# short query is answered straight from the index and a longer one only checks the entries that contain all of its
+# rarest trigrams. A query that matches a header matches the whole option without looking at its flavours, so
+# searching takes about the same time however big the catalog is.
+
+from collections import namedtuple
+
+NGRAM_LENGTH = 3
+
+# The results of a search: the ids of the options whose header matched (all of their flavours count as matches) and
+# the (option id, flavour) pairs whose flavour matched
+SearchResults = namedtuple("SearchResults", ["options", "flavours"])
+
+
+class NgramIndex(object):
+    """
+    Substring search over a set of keys, each with a piece of text.
+    """
+
+    def __init__(self):
+        self.texts = {}  # key -> lower case text that it is matched against
+        self.postings = {}  # n-gram -> set of keys whose text contains it
+        self.last_query = ""
+        self.last_results = set()
+
+    def add(self, key, text):
+        text = text.lower()
+        self.texts[key] = text
+        for length in range(1, NGRAM_LENGTH + 1):
+            for start in range(len(text) - length + 1):
+                self.postings.setdefault(text[start:start + length], set()).add(key)
+
+    def search(self, query):
+        """
+        Return the set of keys whose text contains the (lower case) query. The set must not be modified.
+        """
+        if len(query) <= NGRAM_LENGTH:
+            return self.postings.get(query, set())  # exact, so there's nothing to check
+
+        # Typing one more character can only narrow down the previous results
+        if len(self.last_query) > NGRAM_LENGTH and query.startswith(self.last_query):
+            candidates = self.last_results
+        else:
+            posting_sets = sorted((self.postings.get(query[start:start + NGRAM_LENGTH], set())
+                                   for start in range(len(query) - NGRAM_LENGTH + 1)), key=len)
+            candidates = posting_sets[0].intersection(*posting_sets[1:3])
+
+        results = set(key for key in candidates if query in self.texts[key])
+        self.last_query = query
+        self.last_results = results
+        return results
+
+
+class MenuSearchIndex(object):
+    """
+    Search index of the flavours and option headers of a catalog.
+    """
+
+    def __init__(self, catalog):
+        self.headers = NgramIndex()
+        self.flavours = NgramIndex()
+        for tab in catalog["tabs"]:
+            for option in tab["options"]:
+                self.headers.add(option["id"], option["header"])
+                for flavour in option["flavours"]:
+                    self.flavours.add((option["id"], flavour), flavour)
+
+    def search(self, query):
+        """
+        Return the SearchResults for a query (ignoring case), or None if the query is blank (i.e. everything matches).
+        """
+        query = query.strip().lower()
+        if not query:
+            return None
+        return SearchResults(self.headers.search(query), self.flavours.search(query))
+
+    @staticmethod
+    def matches(results, option_id, flavour):
+        """
+        Return whether a flavour of an option is one of the results of a search.
+        """
+        return results is None or option_id in results.options or (option_id, flavour) in results.flavours
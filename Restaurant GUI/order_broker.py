@@ -0,0 +1,199 @@
+# A local order broker for running many ordering terminals in one restaurant.
+# Terminals (copies of the ordering GUI) connect and send orders, kitchen displays connect and receive every order,
+# and the broker acknowledges each order back to the terminal once it has been handed to the kitchen displays.
+#
+# Messages are JSON objects, one per line, over TCP. A client first says which role it has:
+#     {"type": "hello", "role": "terminal"}  or  {"type": "hello", "role": "kitchen"}
+# then a terminal sends {"type": "order", "order": {"id": ..., ...}} and gets back {"type": "ack", "id": ..., "seq": n},
+# and a kitchen display is sent {"type": "order", "seq": n, "order": {...}} for every order. If no kitchen display is
+# connected to take an order, the terminal gets {"type": "nack", "id": ..., "reason": ...} instead and sends it again
+# later. A message that isn't a valid order (no id, or not JSON at all) gets a nack with "retry": false, since
+# sending it again won't help. An order whose id has already been handed to the kitchens (e.g. resent as part of a
+# retried batch) is acknowledged again with its original sequence number but not sent to the kitchens twice.
+#
+# Run "python order_broker.py" to start the broker and "python order_broker.py --kitchen" for a text kitchen display.
+# broker_benchmark.py measures how many terminals one broker can serve.
+
+import sys
+import json
+import asyncio
+import argparse
+from collections import OrderedDict
+
+BROKER_HOST = "127.0.0.1"
+BROKER_PORT = 8766
+KITCHEN_QUEUE_SIZE = 10000  # orders a kitchen display can fall behind by before it is disconnected
+RECENT_ORDER_LIMIT = 100000  # how many order ids are remembered for spotting repeats
+
+
+def encode(message):
+    return json.dumps(message, separators=(",", ":")).encode() + b"\n"
+
+
+class OrderBroker(object):
+    """
+    Accept orders from terminals, fan them out to kitchen displays and acknowledge them.
+    """
+
+    def __init__(self):
+        self.sequence = 0
+        self.kitchens = set()  # one asyncio.Queue of encoded messages per connected kitchen display
+        self.terminal_count = 0
+        self.delivered = OrderedDict()  # order id -> sequence number, for the most recent orders, oldest first
+
+    async def handle_client(self, reader, writer):
+        try:
+            hello = json.loads(await reader.readline() or b"{}")
+            if not isinstance(hello, dict):
+                return
+            if hello.get("role") == "terminal":
+                await self.serve_terminal(reader, writer)
+            elif hello.get("role") == "kitchen":
+                await self.serve_kitchen(reader, writer)
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve_terminal(self, reader, writer):
+        self.terminal_count += 1
+        try:
+            async for line in reader:
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    # Still reply, so that the terminal gets one reply for every message it sent
+                    writer.write(encode({"type": "nack", "id": None, "reason": "message is not JSON", "retry": False}))
+                    continue
+                if not isinstance(message, dict) or message.get("type") != "order":
+                    continue
+                writer.write(encode(self.take_order(message.get("order"))))
+
+                # Only wait for the terminal to read its acks if they are piling up
+                if writer.transport.get_write_buffer_size() > 64 * 1024:
+                    await writer.drain()
+        finally:
+            self.terminal_count -= 1
+
+    def take_order(self, order):
+        """
+        Hand an order to the kitchen displays (unless it has been already) and return the reply for the terminal.
+        """
+        order_id = order.get("id") if isinstance(order, dict) else None
+        if not isinstance(order_id, str):
+            return {"type": "nack", "id": order_id, "reason": "order has no id", "retry": False}
+        if order_id in self.delivered:
+            return {"type": "ack", "id": order_id, "seq": self.delivered[order_id]}
+
+        if not self.publish(encode({"type": "order", "seq": self.sequence + 1, "order": order})):
+            return {"type": "nack", "id": order_id, "reason": "no kitchen display is connected"}
+        self.sequence += 1
+        self.delivered[order_id] = self.sequence
+        if len(self.delivered) > RECENT_ORDER_LIMIT:
+            self.delivered.popitem(last=False)
+        return {"type": "ack", "id": order_id, "seq": self.sequence}
+
+    def publish(self, encoded_order):
+        """
+        Queue an order for every kitchen display and return how many of them it was queued for.
+        """
+        delivered = 0
+        for kitchen in list(self.kitchens):
+            if kitchen.full():
+                # Too far behind to catch up, so stop sending to it (serve_kitchen then disconnects it)
+                self.kitchens.discard(kitchen)
+            else:
+                kitchen.put_nowait(encoded_order)
+                delivered += 1
+        return delivered
+
+    async def serve_kitchen(self, reader, writer):
+        kitchen = asyncio.Queue(KITCHEN_QUEUE_SIZE)
+        self.kitchens.add(kitchen)
+        sending = asyncio.ensure_future(self.send_to_kitchen(kitchen, writer))
+        watching = asyncio.ensure_future(self.watch_kitchen(kitchen, reader))
+        try:
+            await asyncio.wait([sending, watching], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            self.kitchens.discard(kitchen)
+            sending.cancel()
+            watching.cancel()
+        if sending.done() and not sending.cancelled():
+            sending.result()  # raises the error that stopped it, if any
+
+    async def send_to_kitchen(self, kitchen, writer):
+        while True:
+            # Send everything that is waiting in one write
+            chunks = [await kitchen.get()]
+            while not kitchen.empty():
+                chunks.append(kitchen.get_nowait())
+            writer.write(b"".join(chunks))
+            await writer.drain()
+            if kitchen not in self.kitchens:
+                return
+
+    async def watch_kitchen(self, kitchen, reader):
+        """
+        Wait for a kitchen display to disconnect. Displays don't send anything after their hello, so this is as soon
+        as reading from it ends, and from then on orders aren't counted as handed to it (instead of only once a write
+        to it fails).
+        """
+        try:
+            while await reader.read(4096):
+                pass
+        except ConnectionError:
+            pass
+        finally:
+            self.kitchens.discard(kitchen)
+
+
+async def serve(host=BROKER_HOST, port=BROKER_PORT, ready=None):
+    """
+    Run a broker until cancelled. ready (an asyncio.Event) is set once it is accepting connections.
+    """
+    broker = OrderBroker()
+    server = await asyncio.start_server(broker.handle_client, host, port)
+    if ready is not None:
+        ready.set()
+    async with server:
+        await server.serve_forever()
+
+
+async def connect(role, host=BROKER_HOST, port=BROKER_PORT):
+    """
+    Connect to a broker as a "terminal" or "kitchen" and return the (reader, writer) pair.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(encode({"type": "hello", "role": role}))
+    await writer.drain()
+    return reader, writer
+
+
+async def run_kitchen_display(host, port):
+    reader, writer = await connect("kitchen", host, port)
+    async for line in reader:
+        message = json.loads(line)
+        items = ", ".join(item["label"] for item in message["order"]["items"])
+        print("#{} {}".format(message["seq"], items))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Order broker for the food ordering GUI")
+    parser.add_argument("--host", default=BROKER_HOST)
+    parser.add_argument("--port", type=int, default=BROKER_PORT)
+    parser.add_argument("--kitchen", action="store_true", help="connect as a kitchen display instead of serving")
+    args = parser.parse_args()
+
+    try:
+        if args.kitchen:
+            asyncio.run(run_kitchen_display(args.host, args.port))
+        else:
+            print("Order broker listening on {}:{}".format(args.host, args.port))
+            sys.stdout.flush()
+            asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+# The ordering rules of the food ordering GUI, without any widgets.
+# The engine checks what was chosen against the menu catalog (an item option must be on the tab, each flavour must be
+# one of the option's flavours and an exclusive option can only have one) and turns it into the order's line items.
+# The GUI only collects which radio buttons are checked and hands them to the engine.
+#
+# Run "python order_engine.py orders.csv" (or a .ndjson file, or - for stdin) to validate and total a file of orders,
+# e.g. a bulk import from an online channel. Orders are read, checked and priced one at a time, so the file can be
+# much bigger than memory. Each line item is one row: order_id, category, name, extras (separated by ";") and an
+# optional quantity. A line of NDJSON can also be a whole order as sent to the kitchen ({"id": ..., "items": [...]}).
+# The rows of an order must be next to each other in the file. A row that can't be read (e.g. broken JSON or a missing
+# field) is reported as an invalid order, under its order id if it has one or else its line number, and reading goes on.
+# Files are read as UTF-8, with or without a byte order mark (as spreadsheets often save CSV). Bytes that aren't UTF-8
+# (e.g. "Caf\xe9" saved as Latin-1) are read as U+FFFD, so only the row they are in fails to match the catalog.
+
+import io
+import csv
+import sys
+import json
+import argparse
+from itertools import groupby
+
+from catalog import OrderItem, load_catalog
+from pricing import PriceTable, OrderTotal, format_price
+
+EXTRAS_SEPARATOR = ";"
+
+
+class OrderError(ValueError):
+    """
+    A selection or line item that doesn't follow the menu catalog.
+    """
+
+
+class OrderEngine(object):
+    """
+    Validate selections and line items against a menu catalog and build the order's line items from them.
+    """
+
+    def __init__(self, catalog):
+        self.tabs = {tab["id"]: tab for tab in catalog["tabs"]}
+        self.options = {}  # option id -> (tab, option)
+        self.extra_options = {}  # id of an "item" option -> the "extra" options on the same tab
+        for tab in catalog["tabs"]:
+            extra_options = [option for option in tab["options"] if option["kind"] == "extra"]
+            for option in tab["options"]:
+                self.options[option["id"]] = (tab, option)
+                if option["kind"] == "item":
+                    self.extra_options[option["id"]] = extra_options
+        self.flavours = {option_id: set(option["flavours"]) for option_id, (tab, option) in self.options.items()}
+
+    def check_flavours(self, option, flavours):
+        """
+        Raise OrderError unless flavours are flavours of the option, without repeats, and at most one for an
+        exclusive option.
+        """
+        for flavour in flavours:
+            if flavour not in self.flavours[option["id"]]:
+                raise OrderError("{!r} is not a choice of {}".format(flavour, option["id"]))
+        if len(set(flavours)) != len(flavours):
+            raise OrderError("{} has the same choice more than once".format(option["id"]))
+        if option["exclusive"] and len(flavours) > 1:
+            raise OrderError("only one choice of {} can be made".format(option["id"]))
+
+    def build_items(self, tab_id, selections):
+        """
+        Return the line items made up by the flavours chosen on a tab. selections maps option ids to lists of the
+        flavours chosen. Each flavour of an "item" option is its own line item, and the flavours of the "extra"
+        options are added to the first of them. Raises OrderError if the selections don't follow the catalog.
+        """
+        if tab_id not in self.tabs:
+            raise OrderError("there is no {} tab".format(tab_id))
+        tab = self.tabs[tab_id]
+        for option_id, flavours in selections.items():
+            if option_id not in self.options or self.options[option_id][0] is not tab:
+                raise OrderError("{} is not an option on the {} tab".format(option_id, tab_id))
+            self.check_flavours(self.options[option_id][1], flavours)
+
+        extras = []
+        for option in tab["options"]:
+            if option["kind"] == "extra":
+                extras.extend(selections.get(option["id"], []))
+
+        items = []
+        for option in tab["options"]:
+            if option["kind"] != "item":
+                continue
+            for name in selections.get(option["id"], []):
+                items.append(OrderItem(option["id"], name, tuple(extras), name + option["suffix"]))
+                extras = []  # extras belong to the first item only
+        if extras:
+            raise OrderError("{} can't be chosen without an item".format(", ".join(extras)))
+        return items
+
+    def build_item(self, category, name, extras=()):
+        """
+        Return the line item for a flavour of an "item" option with some extras, as read from a file of orders.
+        Raises OrderError if it doesn't follow the catalog.
+        """
+        if category not in self.extra_options:
+            raise OrderError("{!r} is not an item option".format(category))
+        tab, option = self.options[category]
+        self.check_flavours(option, [name])
+
+        remaining = list(extras)
+        for extra_option in self.extra_options[category]:
+            chosen = [extra for extra in remaining if extra in self.flavours[extra_option["id"]]]
+            self.check_flavours(extra_option, chosen)
+            remaining = [extra for extra in remaining if extra not in chosen]
+        if remaining:
+            raise OrderError("{} can't be added to {}".format(", ".join(remaining), category))
+        return OrderItem(category, name, tuple(extras), name + option["suffix"])
+
+
+def required_field(record, key):
+    """
+    Return a field of a row or record read from a file of orders. Raises OrderError if it is missing or empty.
+    """
+    value = record.get(key)
+    if value is None or value == "":
+        raise OrderError("{} is missing".format(key))
+    return value
+
+
+def line_item(record):
+    """
+    Return (category, name, extras, quantity) for a line item read from a file of orders, where extras is a list or
+    a string of extras separated by EXTRAS_SEPARATOR. Raises OrderError if a field is missing or the wrong type.
+    """
+    if not isinstance(record, dict):
+        raise OrderError("a line item must be an object, not {!r}".format(record))
+    category, name = required_field(record, "category"), required_field(record, "name")
+    extras = record.get("extras") or []
+    if isinstance(extras, str):
+        extras = [extra.strip() for extra in extras.split(EXTRAS_SEPARATOR) if extra.strip()]
+    if not isinstance(extras, list) or not all(isinstance(value, str) for value in [category, name] + extras):
+        raise OrderError("category, name and extras of a line item must be text")
+
+    quantity = record.get("quantity")
+    try:
+        quantity = 1 if quantity is None or quantity == "" else int(quantity)
+    except (TypeError, ValueError):
+        raise OrderError("quantity of {} must be a whole number, not {!r}".format(name, quantity))
+    if quantity < 1:
+        raise OrderError("quantity of {} must be at least 1".format(name))
+    return category, name, extras, quantity
+
+
+def rows_from_csv(lines):
+    """
+    Yield (order id, line item) for each row of a CSV file of line items. The line item is (category, name, extras,
+    quantity), or an OrderError if the row can't be read.
+    """
+    reader = csv.DictReader(lines)
+    for row in reader:
+        order_id = "line {}".format(reader.line_num)
+        try:
+            order_id = required_field(row, "order_id")
+            yield order_id, line_item(row)
+        except OrderError as error:
+            yield order_id, OrderError("line {}: {}".format(reader.line_num, error))
+
+
+def rows_from_ndjson(lines):
+    """
+    Yield (order id, line item) for each line item in an NDJSON file of line items or orders. The line item is
+    (category, name, extras, quantity), or an OrderError if the line can't be read.
+    """
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        order_id = "line {}".format(line_number)
+        try:
+            record = json.loads(line)
+            if isinstance(record, dict) and "items" in record:
+                order_id = required_field(record, "id")
+                if not isinstance(record["items"], list):
+                    raise OrderError("items must be a list")
+                items = [line_item(item) for item in record["items"]]
+            else:
+                if isinstance(record, dict):
+                    order_id = required_field(record, "order_id")
+                items = [line_item(record)]
+        except ValueError as error:  # broken JSON, or an OrderError
+            yield order_id, OrderError("line {}: {}".format(line_number, error))
+            continue
+        for item in items:
+            yield order_id, item
+
+
+def process_orders(engine, price_table, rows):
+    """
+    Group rows of line items into orders, and yield (order id, number of items, total in cents, error) for each
+    order in turn. The total is None and error says why when an order doesn't follow the catalog or one of its rows
+    couldn't be read.
+    """
+    for order_id, order_rows in groupby(rows, key=lambda row: row[0]):
+        order_total = OrderTotal(price_table)
+        item_count = 0
+        try:
+            for _, item in order_rows:
+                if isinstance(item, OrderError):
+                    raise item
+                category, name, extras, quantity = item
+                order_total.add(engine.build_item(category, name, extras), quantity)
+                item_count += quantity
+        except OrderError as error:  # groupby skips the rest of the order's rows
+            yield order_id, item_count, None, str(error)
+        else:
+            yield order_id, item_count, order_total.total, ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate and total a CSV or NDJSON file of orders")
+    parser.add_argument("orders", help="file of orders (.csv, .ndjson or .jsonl), or - to read from stdin")
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="format of the file (default: from its name)")
+    args = parser.parse_args()
+
+    file_format = args.format or ("csv" if args.orders.lower().endswith(".csv") else "ndjson")
+    if args.orders == "-":
+        orders_file = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8-sig", errors="replace", newline="")
+    else:
+        orders_file = open(args.orders, newline="", encoding="utf-8-sig", errors="replace")
+    catalog = load_catalog()
+    engine = OrderEngine(catalog)
+    price_table = PriceTable(catalog)
+    rows = rows_from_csv(orders_file) if file_format == "csv" else rows_from_ndjson(orders_file)
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(["order_id", "items", "total", "error"])
+    order_count = invalid_count = revenue = 0
+    for order_id, item_count, total, error in process_orders(engine, price_table, rows):
+        order_count += 1
+        if total is None:
+            invalid_count += 1
+            writer.writerow([order_id, item_count, "", error])
+        else:
+            revenue += total
+            writer.writerow([order_id, item_count, "{:.2f}".format(total / 100), ""])
+
+    if args.orders != "-":
+        orders_file.close()
+    print("{} orders, {} invalid, {} total".format(order_count, invalid_count, format_price(revenue)), file=sys.stderr)
+    return 1 if invalid_count else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,205 @@
+# Undo and redo for the order basket.
+# Every version of the basket is kept as a persistent balanced tree (an AVL tree whose nodes know the size of their
+# subtree), with the items in order from left to right. A change never modifies a node: adding or removing items
+# copies only the nodes on the path down to where the change is and rebalances them, so consecutive versions share
+# everything else and a step of history costs O(log n) nodes wherever in the order the change is. Each step also
+# records the edit that made it, so undoing or redoing tells the order panel exactly which rows to insert or remove
+# instead of rebuilding the list.
+
+from collections import namedtuple
+
+MAX_UNDO_STEPS = 500  # older steps are forgotten so a long session doesn't keep growing
+
+# A node of a version of the basket: an item, the subtrees of the items before and after it (None when empty), and
+# the number of items and the height of the tree it is the root of. The root node (or None) is the whole basket
+Basket = namedtuple("Basket", ["item", "before", "after", "size", "height"])
+
+# A change to the basket. action is "add" or "remove", row is where the items are in the order (oldest item first)
+Edit = namedtuple("Edit", ["action", "row", "items"])
+
+
+def basket_size(basket):
+    return basket.size if basket is not None else 0
+
+
+def basket_height(basket):
+    return basket.height if basket is not None else 0
+
+
+def make_node(item, before, after):
+    return Basket(item, before, after, basket_size(before) + basket_size(after) + 1,
+                  max(basket_height(before), basket_height(after)) + 1)
+
+
+def balance(item, before, after):
+    """
+    Return a node for item between two subtrees whose heights differ by at most two, rotated to be balanced.
+    """
+    if basket_height(before) > basket_height(after) + 1:
+        if basket_height(before.before) >= basket_height(before.after):
+            return make_node(before.item, before.before, make_node(item, before.after, after))
+        return make_node(before.after.item, make_node(before.item, before.before, before.after.before),
+                         make_node(item, before.after.after, after))
+    if basket_height(after) > basket_height(before) + 1:
+        if basket_height(after.after) >= basket_height(after.before):
+            return make_node(after.item, make_node(item, before, after.before), after.after)
+        return make_node(after.before.item, make_node(item, before, after.before.before),
+                         make_node(after.item, after.before.after, after.after))
+    return make_node(item, before, after)
+
+
+def join(before, item, after):
+    """
+    Return a balanced basket with the items of before, then item, then the items of after. Only the nodes down the
+    side of the taller tree to where the shorter one fits are copied.
+    """
+    if basket_height(before) > basket_height(after) + 1:
+        return balance(before.item, before.before, join(before.after, item, after))
+    if basket_height(after) > basket_height(before) + 1:
+        return balance(after.item, join(before, item, after.before), after.after)
+    return make_node(item, before, after)
+
+
+def build_basket(items, start, end):
+    """
+    Return a balanced basket of items[start:end].
+    """
+    if start >= end:
+        return None
+    middle = (start + end) // 2
+    return make_node(items[middle], build_basket(items, start, middle), build_basket(items, middle + 1, end))
+
+
+def basket_items(basket):
+    """
+    Return the items in a version of the basket, oldest first.
+    """
+    items = []
+    stack = []
+    while stack or basket is not None:
+        if basket is not None:
+            stack.append(basket)
+            basket = basket.before
+        else:
+            basket = stack.pop()
+            items.append(basket.item)
+            basket = basket.after
+    return items
+
+
+def item_at(basket, row):
+    while True:
+        before_size = basket_size(basket.before)
+        if row < before_size:
+            basket = basket.before
+        elif row > before_size:
+            row -= before_size + 1
+            basket = basket.after
+        else:
+            return basket.item
+
+
+def add_items(basket, items):
+    """
+    Return a version of the basket with items added to the end.
+    """
+    items = list(items)
+    if not items:
+        return basket
+    return join(basket, items[0], build_basket(items, 1, len(items)))
+
+
+def remove_item(basket, row):
+    """
+    Return a version of the basket without the item at row. Only the nodes on the path down to it are copied.
+    """
+    before_size = basket_size(basket.before)
+    if row < before_size:
+        return join(remove_item(basket.before, row), basket.item, basket.after)
+    if row > before_size:
+        return join(basket.before, basket.item, remove_item(basket.after, row - before_size - 1))
+    if basket.after is None:
+        return basket.before
+    return join(basket.before, item_at(basket.after, 0), remove_item(basket.after, 0))
+
+
+class OrderHistory(object):
+    """
+    The versions of the basket of one order, with the position of the current one.
+    """
+
+    def __init__(self, max_steps=MAX_UNDO_STEPS):
+        self.max_steps = max_steps
+        self.baskets = [None]  # every version of the basket, oldest first
+        self.edits = []  # edits[i] turns baskets[i] into baskets[i + 1]
+        self.position = 0  # index of the current version
+
+    @property
+    def basket(self):
+        return self.baskets[self.position]
+
+    def size(self):
+        return basket_size(self.basket)
+
+    def items(self):
+        return basket_items(self.basket)
+
+    def can_undo(self):
+        return self.position > 0
+
+    def can_redo(self):
+        return self.position < len(self.edits)
+
+    def add(self, items):
+        """
+        Add items to the end of the order and return the Edit that did it.
+        """
+        edit = Edit("add", self.size(), tuple(items))
+        self.record(add_items(self.basket, edit.items), edit)
+        return edit
+
+    def remove(self, row):
+        """
+        Remove the item at row and return the Edit that did it.
+        """
+        edit = Edit("remove", row, self.items_from(row, 1))
+        self.record(remove_item(self.basket, row), edit)
+        return edit
+
+    def items_from(self, row, count):
+        """
+        Return the count items starting at row, finding each one by walking down the tree.
+        """
+        return tuple(item_at(self.basket, row + offset) for offset in range(count))
+
+    def record(self, basket, edit):
+        """
+        Make basket the current version. Anything that could have been redone is forgotten.
+        """
+        del self.baskets[self.position + 1:]
+        del self.edits[self.position:]
+        self.baskets.append(basket)
+        self.edits.append(edit)
+        if len(self.edits) > self.max_steps:
+            del self.baskets[0]
+            del self.edits[0]
+        self.position = len(self.edits)
+
+    def undo(self):
+        """
+        Go back to the previous version and return the Edit that gets there, or None if there is nothing to undo.
+        """
+        if not self.can_undo():
+            return None
+        self.position -= 1
+        edit = self.edits[self.position]
+        return Edit("remove" if edit.action == "add" else "add", edit.row, edit.items)
+
+    def redo(self):
+        """
+        Go forward to the next version and return the Edit that gets there, or None if there is nothing to redo.
+        """
+        if not self.can_redo():
+            return None
+        self.position += 1
+        return self.edits[self.position - 1]
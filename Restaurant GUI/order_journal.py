@@ -0,0 +1,241 @@
+# A durable journal of every line item added to an order in the ordering GUI, kept in SQLite.
+# Items are recorded by the GUI thread and written by a background thread in batched transactions, so journaling
+# never adds latency to a button click. The database is in WAL mode so it can be queried while it is being written.
+# Orders that are submitted are recorded too (with their total), so abandoned baskets can be told apart from sales.
+
+import json
+import queue
+import sqlite3
+import threading
+import time
+from itertools import groupby
+from operator import itemgetter
+
+JOURNAL_PATH = "orders.db"
+WRITE_BATCH_SIZE = 500  # most items written in one transaction
+WRITE_INTERVAL = 0.5  # seconds to wait for more items before committing a batch
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS order_items (
+        id INTEGER PRIMARY KEY,
+        recorded_at REAL NOT NULL,
+        order_id TEXT NOT NULL,
+        action TEXT NOT NULL,
+        category TEXT NOT NULL,
+        name TEXT NOT NULL,
+        extras TEXT NOT NULL,
+        label TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS order_items_by_time ON order_items (recorded_at);
+    CREATE INDEX IF NOT EXISTS order_items_by_item ON order_items (category, name, recorded_at);
+    CREATE INDEX IF NOT EXISTS order_items_by_order ON order_items (order_id);
+    CREATE TABLE IF NOT EXISTS submitted_orders (
+        order_id TEXT PRIMARY KEY,
+        submitted_at REAL NOT NULL,
+        total INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS submitted_orders_by_time ON submitted_orders (submitted_at);
+    CREATE TABLE IF NOT EXISTS suggestion_counts (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        last_order INTEGER NOT NULL,
+        counts TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS unsent_orders (
+        order_id TEXT PRIMARY KEY,
+        body TEXT NOT NULL
+    );
+"""
+COLUMNS = "recorded_at, order_id, action, category, name, extras, label"
+INSERT_ITEM = "INSERT INTO order_items ({}) VALUES (?, ?, ?, ?, ?, ?, ?)".format(COLUMNS)
+INSERT_SUBMITTED = "INSERT OR REPLACE INTO submitted_orders (submitted_at, order_id, total) VALUES (?, ?, ?)"
+
+
+class OrderJournal(object):
+    """
+    Record line items to the journal from any thread, and query it by time or by item.
+    """
+
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = path
+        self.entries = queue.Queue()
+
+        # Create the database before returning so that queries work straight away
+        connection = self.connect()
+        connection.executescript(SCHEMA)
+        connection.close()
+
+        self.writer = threading.Thread(target=self.write_entries, daemon=True)
+        self.writer.start()
+
+    def connect(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")  # with WAL, a commit is durable once the WAL is synced
+        return connection
+
+    def record(self, order_id, action, item):
+        """
+        Queue a line item (an OrderItem) to be written. action is what happened to it, e.g. "add".
+        """
+        self.entries.put((INSERT_ITEM, (time.time(), order_id, action, item.category, item.name,
+                                        json.dumps(list(item.extras)), item.label)))
+
+    def record_submitted(self, order_id, total):
+        """
+        Queue a submitted order to be written, with its total in cents.
+        """
+        self.entries.put((INSERT_SUBMITTED, (time.time(), order_id, total)))
+
+    def close(self):
+        """
+        Write everything that has been recorded and stop the writer.
+        """
+        self.entries.put(None)
+        self.writer.join()
+
+    def write_entries(self):
+        """
+        Writer loop: collect a batch of entries and write it in one transaction. Each entry is an INSERT statement and
+        the row to insert, and runs of the same statement are inserted together.
+        """
+        connection = self.connect()
+        stopping = False
+        while not stopping:
+            entry = self.entries.get()
+            if entry is None:
+                break
+            batch = [entry]
+            deadline = time.monotonic() + WRITE_INTERVAL
+            while len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    entry = self.entries.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if entry is None:
+                    stopping = True
+                    break
+                batch.append(entry)
+
+            with connection:
+                for statement, entries in groupby(batch, key=itemgetter(0)):
+                    connection.executemany(statement, [row for _, row in entries])
+        connection.close()
+
+    def query(self, sql, parameters):
+        connection = self.connect()
+        try:
+            return connection.execute(sql, parameters).fetchall()
+        finally:
+            connection.close()
+
+    def save_unsent_orders(self, orders):
+        """
+        Keep orders that couldn't be sent to the kitchen before the GUI closed, so they can be sent the next time.
+        """
+        if not orders:
+            return
+        connection = self.connect()
+        try:
+            with connection:
+                connection.executemany("INSERT OR REPLACE INTO unsent_orders (order_id, body) VALUES (?, ?)",
+                                       [(order["id"], json.dumps(order)) for order in orders])
+        finally:
+            connection.close()
+
+    def take_unsent_orders(self):
+        """
+        Return the orders kept by save_unsent_orders and forget them.
+        """
+        connection = self.connect()
+        try:
+            with connection:
+                rows = connection.execute("SELECT body FROM unsent_orders").fetchall()
+                connection.execute("DELETE FROM unsent_orders")
+        finally:
+            connection.close()
+        return [json.loads(body) for body, in rows]
+
+    def items_between(self, start, end):
+        """
+        Return the journal entries recorded between two times (in seconds since the epoch), oldest first.
+        """
+        return self.query("SELECT {} FROM order_items WHERE recorded_at >= ? AND recorded_at < ? "
+                          "ORDER BY recorded_at".format(COLUMNS), (start, end))
+
+    def submitted_items_between(self, start, end):
+        """
+        Return the journal entries of the orders that were submitted between two times, oldest first.
+        """
+        return self.query("SELECT {} FROM order_items JOIN submitted_orders USING (order_id) "
+                          "WHERE submitted_at >= ? AND submitted_at < ? ORDER BY order_items.id".format(COLUMNS),
+                          (start, end))
+
+    def submitted_totals_between(self, start, end):
+        """
+        Return a dict of order id -> total in cents (when it was submitted) for the orders submitted between two times.
+        """
+        return dict(self.query("SELECT order_id, total FROM submitted_orders WHERE submitted_at >= ? "
+                               "AND submitted_at < ?", (start, end)))
+
+    def last_submitted(self):
+        """
+        Return a number that marks the latest submitted order written so far (0 if there are none). Orders submitted
+        later get bigger numbers, so it can be passed to submitted_orders to read only the orders after it.
+        """
+        return self.query("SELECT COALESCE(MAX(rowid), 0) FROM submitted_orders", ())[0][0]
+
+    def item_history(self, category, name, start=0, end=float("inf")):
+        """
+        Return the journal entries for one item (e.g. "wings", "Buffalo") between two times, oldest first.
+        """
+        return self.query("SELECT {} FROM order_items WHERE category = ? AND name = ? AND recorded_at >= ? "
+                          "AND recorded_at < ? ORDER BY recorded_at".format(COLUMNS), (category, name, start, end))
+
+    def item_counts(self, start=0, end=float("inf")):
+        """
+        Return how many of each item were added between two times, less the ones that were removed again, as
+        (category, name, count) rows.
+        """
+        return self.query("SELECT category, name, SUM(CASE action WHEN 'add' THEN 1 ELSE -1 END) AS count "
+                          "FROM order_items WHERE action IN ('add', 'remove') AND recorded_at >= ? AND recorded_at < ? "
+                          "GROUP BY category, name ORDER BY count DESC", (start, end))
+
+    def submitted_orders(self, after=0, up_to=float("inf")):
+        """
+        Yield (order id, entries) for the orders submitted after the mark after and up to the mark up_to (see
+        last_submitted), in the order they were submitted. entries are the order's journal entries in the order they
+        were recorded. Orders are read one at a time, so the whole journal is never in memory.
+        """
+        connection = self.connect()
+        try:
+            rows = connection.execute("SELECT {} FROM submitted_orders JOIN order_items USING (order_id) "
+                                      "WHERE submitted_orders.rowid > ? AND submitted_orders.rowid <= ? "
+                                      "ORDER BY submitted_orders.rowid, order_items.id".format(COLUMNS),
+                                      (after, up_to))
+            for order_id, entries in groupby(rows, key=itemgetter(1)):
+                yield order_id, list(entries)
+        finally:
+            connection.close()
+
+    def save_suggestion_counts(self, last_order, counts):
+        """
+        Keep the counts of a suggestion index (see suggestions.py), which include the submitted orders up to the mark
+        last_order.
+        """
+        connection = self.connect()
+        try:
+            with connection:
+                connection.execute("INSERT OR REPLACE INTO suggestion_counts (id, last_order, counts) VALUES (1, ?, ?)",
+                                   (last_order, json.dumps(counts)))
+        finally:
+            connection.close()
+
+    def load_suggestion_counts(self):
+        """
+        Return (last_order, counts) as kept by save_suggestion_counts, or (0, []) if nothing has been kept.
+        """
+        rows = self.query("SELECT last_order, counts FROM suggestion_counts WHERE id = 1", ())
+        if not rows:
+            return 0, []
+        last_order, counts = rows[0]
+        return last_order, json.loads(counts)
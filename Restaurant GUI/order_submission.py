@@ -0,0 +1,183 @@
+# Sends orders from the ordering GUI to the kitchen.
+# Orders are queued by the GUI thread and sent by a worker thread, so a slow (or down) kitchen never blocks the GUI.
+# Orders that are queued close together are sent in one request, and failed requests are retried with backoff.
+# Run kitchen_server.py for a local stand-in of the kitchen endpoint. With a "tcp://host:port" URL, orders are sent to
+# an order broker (order_broker.py) instead, which passes them on to every kitchen display.
+
+import json
+import queue
+import random
+import socket
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from PyQt5.QtCore import QObject, pyqtSignal
+
+KITCHEN_URL = "http://127.0.0.1:8765/orders"
+REQUEST_TIMEOUT = 5  # seconds
+BATCH_SIZE = 20  # most orders sent in one request
+BATCH_WINDOW = 0.05  # seconds to wait for more orders before sending a batch
+MAX_ATTEMPTS = 6
+STOP_TIMEOUT = 2  # seconds to wait for queued orders to be sent when stopping
+BACKOFF_BASE = 0.5  # seconds before the first retry, doubled for each retry after that
+BACKOFF_MAX = 30
+
+
+class OrderSubmitter(QObject):
+    """
+    Queue orders and send them to the kitchen from a worker thread. Progress is reported through signals, which Qt
+    delivers on the thread the submitter lives in (the GUI thread).
+    """
+    sent = pyqtSignal(str)  # order id
+    retrying = pyqtSignal(str, int, float)  # order id, attempt that failed, seconds until the next attempt
+    failed = pyqtSignal(str, str)  # order id, reason
+
+    def __init__(self, url=KITCHEN_URL, parent=None):
+        super().__init__(parent)
+        self.url = url
+        self.broker_connection = None  # socket file, while connected to an order broker
+        self.orders = queue.Queue()
+        self.unsent = {}  # order id -> order, for orders that are queued or being retried
+        self.unsent_lock = threading.Lock()
+        self.worker = threading.Thread(target=self.send_orders, daemon=True)
+        self.worker.start()
+
+    def submit(self, order):
+        """
+        Queue an order to be sent. order is a dict that can be serialized as JSON and has an "id".
+        """
+        with self.unsent_lock:
+            self.unsent[order["id"]] = order
+        self.orders.put(order)
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """
+        Stop the worker once the orders already queued have been sent (or given up on), waiting at most timeout
+        seconds (None to wait for as long as it takes). Returns the orders that still haven't been sent, so they can
+        be kept and sent again later.
+        """
+        self.orders.put(None)
+        self.worker.join(timeout)
+        with self.unsent_lock:
+            return list(self.unsent.values())
+
+    def finish(self, order):
+        """
+        Forget an order that has been sent or given up on.
+        """
+        with self.unsent_lock:
+            self.unsent.pop(order["id"], None)
+
+    def send_orders(self):
+        """
+        Worker loop: collect a batch of orders and send it until it is accepted or runs out of attempts.
+        """
+        while True:
+            order = self.orders.get()
+            if order is None:
+                return
+            batch = [order]
+            stopping = False
+
+            # Wait a moment for more orders so that a busy terminal sends fewer, bigger requests
+            deadline = time.monotonic() + BATCH_WINDOW
+            while len(batch) < BATCH_SIZE:
+                try:
+                    order = self.orders.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if order is None:
+                    stopping = True
+                    break
+                batch.append(order)
+
+            self.send_batch(batch)
+            if stopping:
+                return
+
+    def send_batch(self, batch):
+        """
+        Send a batch of orders, retrying with exponential backoff (and jitter) if the kitchen can't be reached.
+        """
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                if self.url.startswith("tcp://"):
+                    accepted = self.send_to_broker(batch)
+                else:
+                    accepted = self.post_to_kitchen(batch)
+                for order in batch:
+                    self.finish(order)
+                    if order["id"] in accepted:
+                        self.sent.emit(order["id"])
+                    else:
+                        self.failed.emit(order["id"], "rejected by the kitchen")
+                return
+            except urllib.error.HTTPError as error:
+                reason = "HTTP {}".format(error.code)
+                if error.code < 500:
+                    break  # the kitchen understood the request and refused it, so retrying won't help
+            except (OSError, ValueError, KeyError) as error:
+                reason = str(error) or type(error).__name__
+                self.disconnect_from_broker()
+
+            if attempt < MAX_ATTEMPTS:
+                delay = min(BACKOFF_BASE * 2 ** (attempt - 1), BACKOFF_MAX) * random.uniform(0.5, 1.5)
+                for order in batch:
+                    self.retrying.emit(order["id"], attempt, delay)
+                time.sleep(delay)
+
+        for order in batch:
+            self.finish(order)
+            self.failed.emit(order["id"], reason)
+
+    def post_to_kitchen(self, batch):
+        """
+        POST a batch of orders to the kitchen endpoint and return the set of ids it accepted.
+        """
+        body = json.dumps({"orders": batch}).encode()
+        request = urllib.request.Request(self.url, data=body, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+            return set(json.load(response)["accepted"])
+
+    def send_to_broker(self, batch):
+        """
+        Send a batch of orders to an order broker over one (kept open) connection and return the set of ids it
+        acknowledged. Raises ConnectionError if the broker couldn't take some of them for now, so the batch is retried
+        (the broker doesn't pass on the ones it already took a second time). Orders it refused for good (a nack with
+        "retry": false) are left out of the set.
+        """
+        if self.broker_connection is None:
+            address = urllib.parse.urlsplit(self.url)
+            broker_socket = socket.create_connection((address.hostname, address.port), timeout=REQUEST_TIMEOUT)
+            self.broker_connection = broker_socket.makefile("rwb")
+            broker_socket.close()  # the file keeps the connection open
+            self.broker_connection.write(json.dumps({"type": "hello", "role": "terminal"}).encode() + b"\n")
+
+        for order in batch:
+            self.broker_connection.write(json.dumps({"type": "order", "order": order}).encode() + b"\n")
+        self.broker_connection.flush()
+
+        accepted = set()
+        refusal = None
+        for reply_number in range(len(batch)):
+            line = self.broker_connection.readline()
+            if not line:
+                raise ConnectionError("Order broker closed the connection")
+            reply = json.loads(line)
+            if reply["type"] == "ack":
+                accepted.add(reply["id"])
+            elif reply.get("retry", True):
+                refusal = reply.get("reason", "refused by the order broker")
+        if refusal is not None:
+            raise ConnectionError(refusal)
+        return accepted
+
+    def disconnect_from_broker(self):
+        if self.broker_connection is not None:
+            try:
+                self.broker_connection.close()
+            except OSError:
+                pass
+            self.broker_connection = None
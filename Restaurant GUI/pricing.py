@@ -0,0 +1,198 @@
+# Prices orders from the menu catalog.
+# The catalog is compiled into a dense price table with one column per flavour of every option, holding its price in
+# cents. A line item is priced by adding up the columns it uses. An order's total is kept up to date as items are added
+# and removed (combo discounts only depend on how many items of each option are in the order, not on the items
+# themselves), and stored orders can be re-priced in bulk as a matrix of column counts.
+#
+# Run "python pricing.py" for an end-of-day report of the orders submitted that day, from the order journal.
+
+import json
+import time
+import argparse
+from datetime import datetime, timedelta
+
+from catalog import OrderItem, load_catalog
+
+try:
+    import numpy
+except ImportError:
+    numpy = None  # batch re-pricing falls back to pricing the orders one at a time
+
+
+def to_cents(price):
+    return int(round(price * 100))
+
+
+def format_price(cents):
+    return "${:,.2f}".format(cents / 100)
+
+
+class PriceTable(object):
+    """
+    The prices of everything in a catalog, compiled into a dense table.
+    """
+
+    def __init__(self, catalog):
+        self.columns = {}  # (option id, flavour) -> column of the table
+        self.prices = []  # price in cents of each column
+        self.item_options = []  # ids of the "item" options, in catalog order
+        self.extra_options = {}  # id of an "item" option -> ids of the "extra" options on the same tab
+        for tab in catalog["tabs"]:
+            extra_options = [option["id"] for option in tab["options"] if option["kind"] == "extra"]
+            for option in tab["options"]:
+                if option["kind"] == "item":
+                    self.item_options.append(option["id"])
+                    self.extra_options[option["id"]] = extra_options
+                for flavour in option["flavours"]:
+                    self.columns[(option["id"], flavour)] = len(self.prices)
+                    self.prices.append(to_cents(option["prices"].get(flavour, 0)))
+
+        self.combos = [(combo["name"], tuple(combo["options"]), to_cents(combo["discount"]))
+                       for combo in catalog["combos"]]
+        self.item_option_index = {option_id: index for index, option_id in enumerate(self.item_options)}
+        self.item_column_cache = {}
+
+    def item_columns(self, item):
+        """
+        Return the columns used by a line item: its own flavour followed by each of its extras.
+        Raises KeyError if the item or one of its extras isn't in the catalog.
+        """
+        columns = self.item_column_cache.get(item)
+        if columns is None:
+            columns = [self.columns[(item.category, item.name)]]
+            for extra in item.extras:
+                for option_id in self.extra_options[item.category]:
+                    if (option_id, extra) in self.columns:
+                        columns.append(self.columns[(option_id, extra)])
+                        break
+                else:
+                    raise KeyError(extra)
+            self.item_column_cache[item] = columns
+        return columns
+
+    def item_price(self, item):
+        """
+        Return the price of a line item in cents, including its extras.
+        """
+        return sum(self.prices[column] for column in self.item_columns(item))
+
+    def combo_discount(self, category_counts):
+        """
+        Return the discount in cents for an order with category_counts[option id] items of each option. Combos are
+        applied in catalog order, as many times as the items left over allow.
+        """
+        remaining = dict(category_counts)
+        discount = 0
+        for name, option_ids, combo_discount in self.combos:
+            times = min(remaining.get(option_id, 0) for option_id in option_ids)
+            if times > 0:
+                discount += times * combo_discount
+                for option_id in option_ids:
+                    remaining[option_id] -= times
+        return discount
+
+
+class OrderTotal(object):
+    """
+    The running total of an order, updated as each item is added or removed instead of re-summing the whole order.
+    """
+
+    def __init__(self, price_table):
+        self.price_table = price_table
+        self.subtotal = 0
+        self.discount = 0
+        self.category_counts = {}
+
+    @property
+    def total(self):
+        return self.subtotal - self.discount
+
+    def add(self, item, quantity=1):
+        self.subtotal += quantity * self.price_table.item_price(item)
+        self.category_counts[item.category] = self.category_counts.get(item.category, 0) + quantity
+        self.discount = self.price_table.combo_discount(self.category_counts)
+
+    def remove(self, item, quantity=1):
+        self.add(item, -quantity)
+
+
+def reprice_orders(price_table, orders):
+    """
+    Return the total in cents of each of a list of orders. Each order is a list of (OrderItem, quantity) pairs, where
+    a negative quantity takes items away. With numpy, the orders are priced together as one matrix of counts.
+    """
+    if numpy is None:
+        totals = []
+        for order in orders:
+            order_total = OrderTotal(price_table)
+            for item, quantity in order:
+                order_total.add(item, quantity)
+            totals.append(order_total.total)
+        return totals
+
+    column_counts = numpy.zeros((len(orders), len(price_table.prices)), dtype=numpy.int64)
+    category_counts = numpy.zeros((len(orders), len(price_table.item_options)), dtype=numpy.int64)
+    for row, order in enumerate(orders):
+        for item, quantity in order:
+            for column in price_table.item_columns(item):
+                column_counts[row, column] += quantity
+            category_counts[row, price_table.item_option_index[item.category]] += quantity
+
+    totals = column_counts @ numpy.array(price_table.prices, dtype=numpy.int64)
+    for name, option_ids, combo_discount in price_table.combos:
+        combo_columns = [price_table.item_option_index[option_id] for option_id in option_ids]
+        times = numpy.maximum(category_counts[:, combo_columns].min(axis=1), 0)
+        totals -= times * combo_discount
+        category_counts[:, combo_columns] -= times[:, None]
+    return totals.tolist()
+
+
+def orders_from_journal(rows):
+    """
+    Group journal rows (as returned by OrderJournal.items_between) into orders for reprice_orders.
+    Returns a dict of order id -> list of (OrderItem, quantity) pairs.
+    """
+    orders = {}
+    for recorded_at, order_id, action, category, name, extras, label in rows:
+        item = OrderItem(category, name, tuple(json.loads(extras)), label)
+        orders.setdefault(order_id, []).append((item, -1 if action == "remove" else 1))
+    return orders
+
+
+def main():
+    from order_journal import OrderJournal
+
+    parser = argparse.ArgumentParser(description="End-of-day sales report from the order journal")
+    parser.add_argument("--date", help="day to report on, as YYYY-MM-DD (default: today)")
+    args = parser.parse_args()
+
+    day = datetime.strptime(args.date, "%Y-%m-%d") if args.date else datetime.now()
+    start = day.replace(hour=0, minute=0, second=0, microsecond=0)
+    end = start + timedelta(days=1)
+
+    # Only orders that were submitted count, not baskets that were abandoned or still open when the GUI closed
+    price_table = PriceTable(load_catalog())
+    journal = OrderJournal()
+    rows = journal.submitted_items_between(start.timestamp(), end.timestamp())
+    submitted_totals = journal.submitted_totals_between(start.timestamp(), end.timestamp())
+    journal.close()
+    orders = orders_from_journal(rows)
+
+    started = time.perf_counter()
+    totals = reprice_orders(price_table, list(orders.values()))
+    elapsed = time.perf_counter() - started
+    changed = sum(1 for order_id, total in zip(orders, totals) if submitted_totals.get(order_id) != total)
+
+    revenue = sum(totals)
+    print("Sales for {}".format(start.strftime("%Y-%m-%d")))
+    print("  orders: {}".format(len(totals)))
+    print("  revenue: {}".format(format_price(revenue)))
+    if totals:
+        print("  average order: {}".format(format_price(revenue // len(totals))))
+    if changed:
+        print("  {} order(s) re-priced differently from when they were submitted".format(changed))
+    print("  ({} line items re-priced in {:.1f} ms)".format(len(rows), elapsed * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+# "Frequently ordered together" suggestions for the order panel.
+# A menu choice is a flavour of an option, e.g. ("drinks", "Lemonade") or ("toppings", "Bacon"). Every order adds one
+# to the count of each pair of choices in it, and each choice keeps a short list of the items it is most often ordered
+# with, re-sorted as its counts go up. Counts only ever go up, so that list stays exact without looking at the rest of
+# the history, and suggesting add-ons after an item is added only reads the lists of that item's choices.
+# The counts are kept in the order journal when the GUI closes, so starting up only has to count the orders submitted
+# since then, and that is done in the background.
+
+import json
+
+from catalog import OrderItem
+
+TOP_K = 5  # items kept for each choice
+SUGGESTION_COUNT = 3  # items suggested at a time
+
+
+class CooccurrenceIndex(object):
+    """
+    How often each pair of menu choices has been ordered together, with the top TOP_K items for every choice.
+    """
+
+    def __init__(self, catalog, top_k=TOP_K):
+        self.top_k = top_k
+        self.item_options = set()
+        self.extra_options = {}  # id of an "item" option -> {flavour of an extra on the same tab: its option id}
+        for tab in catalog["tabs"]:
+            extra_options = {flavour: option["id"] for option in tab["options"] if option["kind"] == "extra"
+                             for flavour in option["flavours"]}
+            for option in tab["options"]:
+                if option["kind"] == "item":
+                    self.item_options.add(option["id"])
+                    self.extra_options[option["id"]] = extra_options
+        self.pair_counts = {}  # choice -> {item choice: number of orders with both}
+        self.top_items = {}  # choice -> [[count, item choice], ...], most often ordered together first
+
+    def choices(self, items):
+        """
+        Return the set of menu choices made in a list of line items (OrderItems), including their extras.
+        """
+        choices = set()
+        for item in items:
+            choices.add((item.category, item.name))
+            extra_options = self.extra_options.get(item.category, {})
+            for extra in item.extras:
+                if extra in extra_options:
+                    choices.add((extra_options[extra], extra))
+        return choices
+
+    def add_order(self, items):
+        """
+        Count the line items of an order that has been submitted.
+        """
+        choices = self.choices(items)
+        for choice in choices:
+            counts = self.pair_counts.setdefault(choice, {})
+            top_items = self.top_items.setdefault(choice, [])
+            for other in choices:
+                if other == choice or other[0] not in self.item_options:
+                    continue  # only items are suggested, never extras on their own
+                counts[other] = counts.get(other, 0) + 1
+                self.update_top_items(top_items, other, counts[other])
+
+    def counts(self):
+        """
+        Return the pair counts as a list of [option, flavour, item option, item flavour, count] that can be saved as
+        JSON.
+        """
+        return [list(choice) + list(other) + [count] for choice, counts in self.pair_counts.items()
+                for other, count in counts.items()]
+
+    def load_counts(self, rows):
+        """
+        Replace the pair counts with ones returned by counts(), leaving out items that are no longer on the menu.
+        """
+        self.pair_counts = {}
+        for option, flavour, item_option, item_flavour, count in rows:
+            if item_option in self.item_options:
+                self.pair_counts.setdefault((option, flavour), {})[(item_option, item_flavour)] = count
+        self.top_items = {}
+        for choice, counts in self.pair_counts.items():
+            top_items = sorted(([count, other] for other, count in counts.items()), key=lambda entry: -entry[0])
+            self.top_items[choice] = top_items[:self.top_k]
+
+    def update_top_items(self, top_items, other, count):
+        """
+        Move an item up a choice's top items now that it has been ordered with it count times.
+        """
+        for entry in top_items:
+            if entry[1] == other:
+                entry[0] = count
+                break
+        else:
+            if len(top_items) < self.top_k:
+                top_items.append([count, other])
+            elif count > top_items[-1][0]:
+                top_items[-1] = [count, other]
+            else:
+                return
+        top_items.sort(key=lambda entry: -entry[0])
+
+    def suggest(self, items, ordered_options=(), count=SUGGESTION_COUNT):
+        """
+        Return up to count item choices that are most often ordered with the given line items, one per option and
+        leaving out the options in ordered_options (e.g. the options already in the order).
+        """
+        scores = {}
+        for choice in self.choices(items):
+            for times, other in self.top_items.get(choice, []):
+                if other[0] not in ordered_options:
+                    scores[other] = scores.get(other, 0) + times
+
+        suggestions = []
+        suggested_options = set()
+        for other in sorted(scores, key=lambda other: -scores[other]):
+            if other[0] not in suggested_options:
+                suggestions.append(other)
+                suggested_options.add(other[0])
+        return suggestions[:count]
+
+
+def load_from_journal(index, journal, last_order):
+    """
+    Load the counts kept in the order journal into an empty index, then count the orders submitted after they were
+    kept, up to the mark last_order (see OrderJournal.last_submitted). Items that were added to an order and then
+    removed don't count.
+    """
+    kept_through, counts = journal.load_suggestion_counts()
+    index.load_counts(counts)
+    for order_id, entries in journal.submitted_orders(kept_through, last_order):
+        quantities = {}
+        for recorded_at, _, action, category, name, extras, label in entries:
+            item = OrderItem(category, name, tuple(json.loads(extras)), label)
+            quantities[item] = quantities.get(item, 0) + (-1 if action == "remove" else 1)
+        index.add_order([item for item, quantity in quantities.items() if quantity > 0])
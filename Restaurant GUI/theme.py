@@ -0,0 +1,175 @@
+# Applies the GUI's style sheet without running every widget through Qt's style sheet engine.
+# The style sheet is compiled once per (widget class, object name) into either a palette (for widgets that only need
+# colours, and for containers) or a small style sheet scoped to that one widget, and the compiled results are cached.
+# The bare "QWidget" rule becomes the application palette. Only the widgets that need borders, padding or pseudo-states
+# (labels, buttons, etc.) are given a style sheet, so radio buttons, group boxes and the containers they sit in are
+# never polished by the style sheet engine.
+#
+# With measure=True the time spent restyling and polishing widgets is recorded and printed by report().
+
+import re
+import time
+from PyQt5.QtWidgets import QApplication, QWidget
+from PyQt5.QtGui import QPalette, QColor
+
+RULE_PATTERN = re.compile(r"(\w+)(?:#(\w+))?(?::(\w+))?\s*\{([^}]*)\}")
+PALETTE_PROPERTIES = {
+    "background-color": (QPalette.Window, QPalette.Base, QPalette.Button),
+    "color": (QPalette.WindowText, QPalette.Text, QPalette.ButtonText)
+}
+
+# A style sheet on a widget sends all of its descendants through the style sheet engine as well, so these classes
+# only ever get a palette (their borders and corner radii are dropped)
+CONTAINER_CLASSES = ("QWidget", "QGroupBox", "QTabWidget")
+
+
+class Theme(object):
+    """
+    A style sheet compiled into palettes and scoped style sheets.
+    """
+
+    def __init__(self, style_sheet, scoped=True, measure=False):
+        self.style_sheet = style_sheet
+        self.scoped = scoped  # if False, the style sheet is applied to the whole application as usual
+        self.measure = measure
+        self.rules = []  # (class name, object name, pseudo-state, {property: value}) in style sheet order
+        for class_name, object_name, pseudo_state, body in RULE_PATTERN.findall(style_sheet):
+            properties = {}
+            for declaration in body.split(";"):
+                if ":" in declaration:
+                    name, value = declaration.split(":", 1)
+                    properties[name.strip()] = value.strip()
+            self.rules.append((class_name, object_name or None, pseudo_state or None, properties))
+
+        self.compiled = {}  # (class name, object name) -> (QPalette or None, style sheet or None)
+        self.timings = {}  # what was timed -> [number of times, total seconds]
+
+    def record(self, name, seconds):
+        timing = self.timings.setdefault(name, [0, 0.0])
+        timing[0] += 1
+        timing[1] += seconds
+
+    def apply_to_application(self, app):
+        """
+        Give the application the base colours (or, if not scoped, the whole style sheet).
+        """
+        started = time.perf_counter()
+        if self.scoped:
+            palette = app.palette()
+            for class_name, object_name, pseudo_state, properties in self.rules:
+                if class_name == "QWidget" and object_name is None and pseudo_state is None:
+                    self.set_palette_colours(palette, properties)
+            app.setPalette(palette)
+        else:
+            app.setStyleSheet(self.style_sheet)
+        self.record("apply to application", time.perf_counter() - started)
+
+    def apply(self, root):
+        """
+        Style a widget and all of its children that haven't been styled yet. Call this again for widgets that are
+        created later on (e.g. when a tab is built).
+        """
+        widgets = [root] + root.findChildren(QWidget)
+        if self.scoped:
+            started = time.perf_counter()
+            for widget in widgets:
+                if widget.property("themed"):
+                    continue
+                palette, style_sheet = self.compile(widget)
+                if palette is not None:
+                    widget.setPalette(palette)
+                    widget.setAutoFillBackground(True)
+                if style_sheet is not None:
+                    widget.setStyleSheet(style_sheet)
+                widget.setProperty("themed", True)
+            self.record("restyle", time.perf_counter() - started)
+
+        if self.measure:
+            # Widgets are polished when they are first shown anyway, this just does it now so that it can be timed
+            started = time.perf_counter()
+            for widget in widgets:
+                widget.ensurePolished()
+            self.record("polish", time.perf_counter() - started)
+
+    def compile(self, widget):
+        """
+        Return the (palette, style sheet) for a widget, compiling them the first time its class and object name are
+        seen.
+        """
+        class_name = widget.metaObject().className()
+        object_name = widget.objectName() or None
+        key = (class_name, object_name)
+        if key in self.compiled:
+            return self.compiled[key]
+
+        started = time.perf_counter()
+
+        # Class names from the most basic to the widget's own class
+        class_names = []
+        meta_object = widget.metaObject()
+        while meta_object is not None:
+            class_names.insert(0, meta_object.className())
+            meta_object = meta_object.superClass()
+
+        # Cascade the matching rules like the style sheet engine does: type selectors first, then the more specific
+        # object name selectors. The bare QWidget rule is already in the application palette.
+        properties = {}
+        pseudo_properties = {}
+        matched = False
+        for with_object_name in (False, True):
+            for rule_class, rule_object_name, pseudo_state, rule_properties in self.rules:
+                if rule_class not in class_names or (rule_object_name is not None) != with_object_name:
+                    continue
+                if rule_object_name is not None and rule_object_name != object_name:
+                    continue
+                if rule_class == "QWidget" and rule_object_name is None:
+                    continue
+                matched = True
+                if pseudo_state is None:
+                    properties.update(rule_properties)
+                else:
+                    pseudo_properties.setdefault(pseudo_state, {}).update(rule_properties)
+
+        palette = None
+        style_sheet = None
+        if matched:
+            needs_style_sheet = bool(pseudo_properties) or any(name not in PALETTE_PROPERTIES for name in properties)
+            if needs_style_sheet and class_name not in CONTAINER_CLASSES:
+                # Scope the selector to this exact class (and object name) so that it can't match any children
+                selector = "." + class_name + ("#" + object_name if object_name else "")
+                blocks = [(selector, properties)]
+                blocks += [(selector + ":" + state, state_properties)
+                           for state, state_properties in pseudo_properties.items()]
+                style_sheet = "".join("{}{{{}}}".format(block_selector, "; ".join(
+                    "{}: {}".format(name, value) for name, value in block_properties.items()))
+                    for block_selector, block_properties in blocks)
+            else:
+                # Start from the application's colours and set every role explicitly, otherwise colours would be
+                # inherited from the parent's palette (unlike style sheet properties)
+                palette = QPalette(QApplication.palette())
+                for roles in PALETTE_PROPERTIES.values():
+                    for role in roles:
+                        palette.setColor(role, palette.color(role))
+                self.set_palette_colours(palette, properties)
+
+        self.compiled[key] = (palette, style_sheet)
+        self.record("compile", time.perf_counter() - started)
+        return self.compiled[key]
+
+    @staticmethod
+    def set_palette_colours(palette, properties):
+        for name, roles in PALETTE_PROPERTIES.items():
+            if name in properties:
+                for role in roles:
+                    palette.setColor(role, QColor(properties[name]))
+
+    def report(self):
+        """
+        Print how long styling took, if it was being measured.
+        """
+        if not self.measure:
+            return
+        print("Styling ({} style sheet):".format("scoped" if self.scoped else "application-wide"))
+        for name, (count, seconds) in self.timings.items():
+            print("  {}: {:.2f} ms over {} calls".format(name, seconds * 1000, count))
+        print("  compiled {} widget styles".format(len(self.compiled)))